@@ -0,0 +1,108 @@
+import os
+import sys
+import argparse
+import numpy as np
+import pandas as pd
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), '..'))
+from schema import CSV_COLUMNS, READ_DATATYPES, NULLABLE_INT_COLUMNS  # noqa: E402
+from business_rules import BUSINESS_RULES  # noqa: E402
+
+
+GENERATE_CHUNK_ROWS = 1_000_000
+MONTH_NAMES = ['January', 'February', 'March', 'April', 'May', 'June', 'July', 'August', 'September', 'October',
+               'November', 'December']
+
+# Values for the columns whose rule has no allowed set, or whose bounds are too loose to give realistic data.
+TEXT_VALUES = {
+    'arrival_date_month': MONTH_NAMES,
+    'meal': ['BB', 'FB', 'HB', 'SC', 'Undefined'],
+    'country': ['PRT', 'GBR', 'FRA', 'ESP', 'DEU', 'ITA', 'IRL', 'BEL', 'BRA', 'NLD', 'USA', 'CHE', 'CHN', 'TMP'],
+}
+NUMBER_RANGES = {
+    'lead_time': (0, 740),
+    'arrival_date_year': (2015, 2017),
+    'arrival_date_week_number': (1, 53),
+    'arrival_date_day_of_month': (1, 28),
+    'stays_in_weekend_nights': (0, 19),
+    'stays_in_week_nights': (0, 50),
+    'adults': (0, 4),
+    'children': (0, 3),
+    'babies': (0, 2),
+    'previous_cancellations': (0, 26),
+    'previous_bookings_not_canceled': (0, 72),
+    'booking_changes': (0, 21),
+    'agent': (1, 535),
+    'company': (6, 543),
+    'days_in_waiting_list': (0, 391),
+    'required_car_parking_spaces': (0, 3),
+    'total_of_special_requests': (0, 5),
+}
+# Codes handle_business_logic_issues knows how to fix, unfixable codes are left as business rule violations.
+BAD_COUNTRY_CODES = ['CN']
+
+
+def generate_chunk(rng: np.random.Generator, rows: int, null_rate: float, duplicate_rate: float,
+                   bad_country_rate: float, negative_adr_rate: float, bad_country_codes: list):
+    allowed_values = {rule['column']: sorted(rule['allowed']) for rule in BUSINESS_RULES if 'allowed' in rule}
+    columns = {}
+    for column, dtype in READ_DATATYPES.items():
+        if column in TEXT_VALUES:
+            columns[column] = rng.choice(TEXT_VALUES[column], rows)
+        elif column in allowed_values:
+            columns[column] = rng.choice(allowed_values[column], rows)
+        elif column in NUMBER_RANGES:
+            low, high = NUMBER_RANGES[column]
+            columns[column] = rng.integers(low, high + 1, rows).astype(dtype)
+        elif column == 'adr':
+            columns[column] = np.round(rng.gamma(4.0, 25.0, rows), 2)
+        elif column == 'reservation_status_date':
+            days = rng.integers(0, 1080, rows)
+            columns[column] = (np.datetime64('2014-10-17') + days).astype(str)
+    df = pd.DataFrame(columns)
+
+    for column in NULLABLE_INT_COLUMNS + ['country']:
+        df.loc[rng.random(rows) < null_rate, column] = np.nan
+    bad_countries = rng.random(rows) < bad_country_rate
+    df.loc[bad_countries, 'country'] = rng.choice(bad_country_codes, int(bad_countries.sum()))
+    negative_adr = rng.random(rows) < negative_adr_rate
+    df.loc[negative_adr, 'adr'] = -df.loc[negative_adr, 'adr']
+
+    # Duplicates copy an earlier row of the same chunk over a later one. Following the copies until they stop
+    # changing makes a row copied from a row that was itself replaced end up with the final value.
+    duplicates = int(rows * duplicate_rate)
+    rows_taken = np.arange(rows)
+    if duplicates:
+        targets = rng.choice(np.arange(1, rows), duplicates, replace=False)
+        rows_taken[targets] = (rng.random(duplicates) * targets).astype(np.int64)
+        while not np.array_equal(rows_taken[rows_taken], rows_taken):
+            rows_taken = rows_taken[rows_taken]
+    return df.iloc[rows_taken][CSV_COLUMNS]
+
+
+def generate_bookings(path: str, rows: int, seed: int = 42, null_rate: float = 0.01, duplicate_rate: float = 0.2,
+                      bad_country_rate: float = 0.005, negative_adr_rate: float = 0.001,
+                      bad_country_codes: list = BAD_COUNTRY_CODES):
+    # Written in chunks so files far larger than memory can be generated. The same arguments give the same file.
+    rng = np.random.default_rng(seed)
+    temporary_path = path + '.tmp'
+    for start in range(0, rows, GENERATE_CHUNK_ROWS):
+        chunk = generate_chunk(rng, min(GENERATE_CHUNK_ROWS, rows - start), null_rate, duplicate_rate,
+                               bad_country_rate, negative_adr_rate, bad_country_codes)
+        chunk.to_csv(temporary_path, index=False, header=start == 0, mode='w' if start == 0 else 'a')
+    os.replace(temporary_path, path)
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description='Generate a synthetic hotel_bookings.csv')
+    parser.add_argument('path')
+    parser.add_argument('--rows', type=int, default=100_000)
+    parser.add_argument('--seed', type=int, default=42)
+    parser.add_argument('--null-rate', type=float, default=0.01)
+    parser.add_argument('--duplicate-rate', type=float, default=0.2)
+    parser.add_argument('--bad-country-rate', type=float, default=0.005)
+    parser.add_argument('--negative-adr-rate', type=float, default=0.001)
+    parser.add_argument('--bad-country-codes', nargs='+', default=BAD_COUNTRY_CODES)
+    args = parser.parse_args()
+    generate_bookings(args.path, args.rows, args.seed, args.null_rate, args.duplicate_rate, args.bad_country_rate,
+                      args.negative_adr_rate, args.bad_country_codes)
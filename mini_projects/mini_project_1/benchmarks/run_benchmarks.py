@@ -0,0 +1,148 @@
+import os
+import sys
+import json
+import time
+import shutil
+import argparse
+import datetime
+import tracemalloc
+import subprocess
+import contextlib
+
+PROJECT_DIR = os.path.join(os.path.dirname(os.path.abspath(__file__)), '..')
+sys.path.insert(0, PROJECT_DIR)
+import clean_data  # noqa: E402
+from schema import read_bookings  # noqa: E402
+from dedup import row_hashes, find_duplicates  # noqa: E402
+from generate_bookings import generate_bookings  # noqa: E402
+
+
+# Prints the peak RSS of the child process as its last line, main() itself does not report memory.
+MAIN_RUNNER = '''
+import os, sys, json, resource, runpy
+sys.path.insert(0, os.path.dirname(sys.argv[1]))
+runpy.run_path(sys.argv[1], run_name="__main__")
+print(json.dumps({"peak_rss_kb": resource.getrusage(resource.RUSAGE_SELF).ru_maxrss}))
+'''
+
+
+def git_commit():
+    try:
+        return subprocess.run(['git', 'rev-parse', '--short', 'HEAD'], cwd=PROJECT_DIR, capture_output=True,
+                              text=True, check=True).stdout.strip()
+    except (OSError, subprocess.CalledProcessError):
+        return None
+
+
+def measure(function, make_input):
+    # Timed and memory traced in separate runs, tracemalloc slows down the code it traces. Peak memory is what
+    # python and numpy allocated while the function ran, pandas data lives in numpy arrays.
+    with open(os.devnull, 'w') as devnull, contextlib.redirect_stdout(devnull):
+        argument = make_input()
+        start = time.perf_counter()
+        result = function(argument)
+        seconds = time.perf_counter() - start
+
+        argument = make_input()
+        tracemalloc.start()
+        function(argument)
+        _, peak = tracemalloc.get_traced_memory()
+        tracemalloc.stop()
+    return result, seconds, peak
+
+
+def result_record(name: str, rows: int, seconds: float, peak_bytes: int):
+    return {
+        'benchmark': name,
+        'rows': rows,
+        'seconds': round(seconds, 6),
+        'rows_per_second': round(rows / seconds) if seconds else None,
+        'peak_memory_mb': round(peak_bytes / 1024 ** 2, 2),
+    }
+
+
+def benchmark_functions(csv_path: str, rows: int):
+    # Every check_*/handle_* function runs on the frame the pipeline would hand it. handle_* functions get a
+    # fresh copy for each run since some of them change their input.
+    records = []
+    raw, seconds, peak = measure(read_bookings, lambda: csv_path)
+    records.append(result_record('read_bookings', rows, seconds, peak))
+
+    def run(name, function, df, copy=False):
+        result, seconds, peak = measure(function, (lambda: df.copy()) if copy else (lambda: df))
+        records.append(result_record(name, df.shape[0], seconds, peak))
+        return result
+
+    run('check_missing_values', clean_data.check_missing_values, raw)
+    no_missing = run('handle_missing_values', clean_data.handle_missing_values, raw)
+    run('check_datatypes_ok', clean_data.check_datatypes_ok, no_missing)
+    typed = run('handle_invalid_datatypes', clean_data.handle_invalid_datatypes, no_missing, copy=True)
+    # The business rules check arrival_date, which the dates stage adds.
+    dated = run('dates_stage', clean_data.dates_stage, typed, copy=True)
+    duplicates = run('find_duplicates', lambda df: find_duplicates(row_hashes(df), df.index.to_numpy()), dated)
+    run('check_duplicates', lambda df: clean_data.check_duplicates(df, duplicates), dated)
+    deduplicated = run('handle_duplicates', lambda df: clean_data.handle_duplicates(df, duplicates), dated)
+    run('check_business_logic', clean_data.check_business_logic, deduplicated)
+    run('handle_business_logic_issues', clean_data.handle_business_logic_issues, deduplicated, copy=True)
+    return records
+
+
+def benchmark_main(csv_path: str, rows: int, work_dir: str):
+    # main() reads ./hotel_bookings.csv, asks about duplicates and loads postgres, so it runs in a child process in
+    # a scratch directory with the answer piped in and the database load switched off.
+    os.makedirs(work_dir, exist_ok=True)
+    shutil.copy(csv_path, os.path.join(work_dir, 'hotel_bookings.csv'))
+    env = dict(os.environ, LOAD_MODE='none', CSV_CACHE='off', CHECKPOINT_DIR='', CHUNK_SIZE='0', WORKERS='1')
+    start = time.perf_counter()
+    completed = subprocess.run([sys.executable, '-c', MAIN_RUNNER, os.path.join(PROJECT_DIR, 'clean_data.py')],
+                               cwd=work_dir, input='yes\n', capture_output=True, text=True, env=env, check=True)
+    seconds = time.perf_counter() - start
+    peak_rss_kb = json.loads(completed.stdout.strip().splitlines()[-1])['peak_rss_kb']
+    return [result_record('main', rows, seconds, peak_rss_kb * 1024)]
+
+
+def compare(results: list, baseline_path: str):
+    with open(baseline_path) as f:
+        baseline = {(r['benchmark'], r['input_rows']): r for r in map(json.loads, f)}
+    for record in results:
+        before = baseline.get((record['benchmark'], record['input_rows']))
+        if before:
+            print(f"{record['benchmark']:<30} {record['input_rows']:>10} rows  {before['seconds']:.3f}s -> "
+                  f"{record['seconds']:.3f}s ({record['seconds'] / before['seconds']:.2f}x)  "
+                  f"{before['peak_memory_mb']:.1f} -> {record['peak_memory_mb']:.1f} MiB")
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description='Benchmark the hotel bookings cleaning stages')
+    parser.add_argument('--rows', type=int, nargs='+', default=[100_000])
+    parser.add_argument('--data-dir', default=os.path.join(PROJECT_DIR, 'benchmarks', 'data'))
+    parser.add_argument('--output', default=os.path.join(PROJECT_DIR, 'benchmarks', 'results.jsonl'))
+    parser.add_argument('--compare', help='earlier results file to compare this run against')
+    parser.add_argument('--skip-main', action='store_true')
+    parser.add_argument('--seed', type=int, default=42)
+    args = parser.parse_args()
+
+    commit = git_commit()
+    run_at = datetime.datetime.now(datetime.timezone.utc).isoformat()
+    results = []
+    for rows in args.rows:
+        csv_path = os.path.join(args.data_dir, f'hotel_bookings_{rows}_{args.seed}.csv')
+        if not os.path.exists(csv_path):
+            os.makedirs(args.data_dir, exist_ok=True)
+            print(f'Generating {rows} rows into {csv_path}')
+            generate_bookings(csv_path, rows, seed=args.seed)
+        records = benchmark_functions(csv_path, rows)
+        if not args.skip_main:
+            records += benchmark_main(csv_path, rows, os.path.join(args.data_dir, 'main'))
+        for record in records:
+            record.update({'commit': commit, 'run_at': run_at, 'input_rows': rows, 'seed': args.seed})
+            print(f"{record['benchmark']:<30} {record['rows']:>10} rows  {record['seconds']:>8.3f}s  "
+                  f"{record['rows_per_second'] or 0:>12,} rows/s  {record['peak_memory_mb']:>8.1f} MiB")
+        results += records
+
+    with open(args.output, 'a') as f:
+        for record in results:
+            f.write(json.dumps(record) + '\n')
+    print(f'Results appended to {args.output}')
+    if args.compare:
+        compare(results, args.compare)
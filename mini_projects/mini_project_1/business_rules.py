@@ -0,0 +1,206 @@
+import time
+import string
+import numpy as np
+import pandas as pd
+import iso3166
+from column_profile import distinct_count
+
+
+MONTHS = {'January', 'February', 'March', 'April', 'May', 'June', 'July', 'August', 'September', 'October',
+          'November', 'December'}
+ROOM_TYPES = set(string.ascii_uppercase)
+
+# Built once per process instead of on every check. TMP is the old code for East Timor and shows up in the data.
+VALID_COUNTRY_CODES = frozenset([c.alpha3 for c in iso3166.countries] + ['TMP'])
+
+
+'''
+
+Business rules:
+   Every rule targets one column and can combine the following keys:
+      allowed    -> set of values the column may contain
+      nunique    -> exact number of distinct values the column should have
+      min / max  -> inclusive numeric bounds
+      sentinels  -> values allowed below min, eg: -99 used to fill missing agent and company values
+      date_min / date_max -> inclusive date bounds, datetime columns are used as they are and text is parsed
+
+'''
+BUSINESS_RULES = [
+    {'column': 'hotel', 'allowed': {'Resort Hotel', 'City Hotel'}},
+    {'column': 'is_canceled', 'allowed': {0, 1}},
+    {'column': 'lead_time', 'min': 0},
+    {'column': 'arrival_date_year', 'min': 2000, 'max': 2025},
+    {'column': 'arrival_date_month', 'allowed': MONTHS, 'nunique': 12},
+    {'column': 'arrival_date_week_number', 'min': 1, 'max': 53},
+    {'column': 'arrival_date_day_of_month', 'min': 1, 'max': 31},
+    {'column': 'arrival_date', 'date_min': pd.Timestamp('2000-01-01'), 'date_max': pd.Timestamp('2025-12-31')},
+    {'column': 'stays_in_weekend_nights', 'min': 0},
+    {'column': 'stays_in_week_nights', 'max': 1000},
+    {'column': 'adults', 'min': 0},
+    {'column': 'children', 'min': 0},
+    {'column': 'babies', 'min': 0},
+    {'column': 'meal', 'nunique': 5},
+    {'column': 'country', 'allowed': VALID_COUNTRY_CODES},
+    {'column': 'market_segment', 'nunique': 7,
+     'allowed': {'Direct', 'Corporate', 'Online TA', 'Offline TA/TO', 'Complementary', 'Groups', 'Aviation'}},
+    {'column': 'distribution_channel', 'nunique': 5, 'allowed': {'Direct', 'Corporate', 'TA/TO', 'Undefined', 'GDS'}},
+    {'column': 'is_repeated_guest', 'allowed': {0, 1}},
+    {'column': 'previous_cancellations', 'min': 0},
+    {'column': 'previous_bookings_not_canceled', 'min': 0},
+    {'column': 'reserved_room_type', 'allowed': ROOM_TYPES},
+    {'column': 'assigned_room_type', 'allowed': ROOM_TYPES},
+    {'column': 'booking_changes', 'min': 0},
+    {'column': 'deposit_type', 'nunique': 3, 'allowed': {'No Deposit', 'Non Refund', 'Refundable'}},
+    {'column': 'agent', 'min': -1, 'sentinels': {-99}},
+    {'column': 'company', 'min': -1, 'sentinels': {-99}},
+    {'column': 'days_in_waiting_list', 'min': 0},
+    {'column': 'customer_type', 'nunique': 4, 'allowed': {'Contract', 'Group', 'Transient', 'Transient-Party'}},
+    {'column': 'adr', 'min': 0},
+    {'column': 'required_car_parking_spaces', 'min': 0},
+    {'column': 'total_of_special_requests', 'min': 0},
+    {'column': 'reservation_status', 'nunique': 3, 'allowed': {'Canceled', 'Check-Out', 'No-Show'}},
+    {'column': 'reservation_status_date', 'date_min': pd.Timestamp('2000-01-01'), 'date_max': pd.Timestamp('2025-01-01')},
+]
+
+
+def evaluate_rule(rule: dict, column: pd.Series):
+    mask = np.zeros(len(column), dtype=bool)
+    passed = True
+
+    if 'allowed' in rule or 'nunique' in rule:
+        # One hash pass gives both the distinct values and the position of every row in them.
+        codes, uniques = pd.factorize(column)
+        if 'nunique' in rule and len(uniques) != rule['nunique']:
+            passed = False
+        if 'allowed' in rule:
+            # The extra True at the end catches missing values which factorize codes as -1.
+            bad_values = np.append(~pd.Index(uniques).isin(rule['allowed']), True)
+            mask |= bad_values[codes]
+
+    if 'min' in rule:
+        # Not updated in place, with copy on write to_numpy() can hand out a read only view.
+        below = (column < rule['min']).to_numpy()
+        if 'sentinels' in rule:
+            below = below & ~column.isin(rule['sentinels']).to_numpy()
+        mask |= below
+
+    if 'max' in rule:
+        mask |= (column > rule['max']).to_numpy()
+
+    if 'date_min' in rule or 'date_max' in rule:
+        dates = column if pd.api.types.is_datetime64_any_dtype(column) else pd.to_datetime(column, errors='coerce')
+        mask |= dates.isna().to_numpy()
+        if 'date_min' in rule:
+            mask |= (dates < rule['date_min']).to_numpy()
+        if 'date_max' in rule:
+            mask |= (dates > rule['date_max']).to_numpy()
+
+    violations = int(mask.sum())
+    return {
+        'column': rule['column'],
+        'passed': passed and violations == 0,
+        'violations': violations,
+        'mask': mask,
+    }
+
+
+def evaluate_rules(df: pd.DataFrame, rules: list = BUSINESS_RULES):
+    # Returns {column: result} where result holds passed, violations (row count), mask (rows breaking the rule)
+    # and seconds spent on the rule.
+    results = {}
+    for rule in rules:
+        start = time.perf_counter()
+        result = evaluate_rule(rule, df[rule['column']])
+        result['seconds'] = time.perf_counter() - start
+        results[rule['column']] = result
+    return results
+
+
+def revalidate_rules(df: pd.DataFrame, results: dict, changed_rows: dict, rules: list = BUSINESS_RULES):
+    # changed_rows maps a column to a mask of the rows a fix changed, fixes must leave the rows where they are.
+    # Only the rules on those columns run again and only on the changed rows, the rest of the mask is kept.
+    # nunique depends on the whole column so those rules run on the full column. Rules that were not run again
+    # report 0 seconds.
+    results = {column: dict(result, seconds=0.0) for column, result in results.items()}
+    for rule in rules:
+        column = rule['column']
+        if column not in changed_rows:
+            continue
+        start = time.perf_counter()
+        if 'nunique' in rule:
+            result = evaluate_rule(rule, df[column])
+        else:
+            positions = np.flatnonzero(changed_rows[column])
+            mask = results[column]['mask'].copy()
+            mask[positions] = evaluate_rule(rule, df[column].iloc[positions])['mask']
+            violations = int(mask.sum())
+            result = {'column': column, 'passed': violations == 0, 'violations': violations, 'mask': mask}
+        result['seconds'] = time.perf_counter() - start
+        results[column] = result
+    return results
+
+
+def evaluate_profile_rule(rule: dict, sketch: dict):
+    # The same rule on a merged column profile (column_profile.py). Violations are counted from the exact value
+    # counts. Once a column has too many distinct values for those, min/max still say whether the rule passed but
+    # not how many rows break it (violations is None), values below min are assumed to be sentinels when the
+    # smallest one is. allowed cannot be checked without the counts and fails.
+    counts = sketch['counts']
+    passed = True
+    violations = 0
+    bad_values = set()
+
+    if 'nunique' in rule and distinct_count(sketch) != rule['nunique']:
+        passed = False
+    if 'allowed' in rule:
+        violations += sketch['nulls']
+        if counts is None:
+            passed = False
+        else:
+            bad_values.update(value for value in counts if value not in rule['allowed'])
+    if 'min' in rule and sketch['min'] is not None and sketch['min'] < rule['min']:
+        if counts is not None:
+            bad_values.update(value for value in counts
+                              if value < rule['min'] and value not in rule.get('sentinels', set()))
+        elif sketch['min'] not in rule.get('sentinels', set()):
+            passed = False
+    if 'max' in rule and sketch['max'] is not None and sketch['max'] > rule['max']:
+        if counts is not None:
+            bad_values.update(value for value in counts if value > rule['max'])
+        else:
+            passed = False
+    if 'date_min' in rule or 'date_max' in rule:
+        # Date rules need a datetime column, the text is not parsed here.
+        violations += sketch['nulls']
+        out_of_range = ((sketch['min'] is not None and sketch['min'] < rule.get('date_min', sketch['min']))
+                        or (sketch['max'] is not None and sketch['max'] > rule.get('date_max', sketch['max'])))
+        if counts is not None:
+            bad_values.update(value for value in counts if value < rule.get('date_min', value)
+                              or value > rule.get('date_max', value))
+        elif out_of_range:
+            passed = False
+
+    violations += sum(counts[value] for value in bad_values) if counts is not None else 0
+    if counts is None and not passed:
+        violations = None
+    return {
+        'column': rule['column'],
+        'passed': passed and violations == 0,
+        'violations': violations,
+        'mask': None,
+    }
+
+
+def evaluate_profile_rules(profile: dict, rules: list = BUSINESS_RULES):
+    # Same results as evaluate_rules without the row masks, there are no rows to point at.
+    results = {}
+    for rule in rules:
+        start = time.perf_counter()
+        result = evaluate_profile_rule(rule, profile['columns'][rule['column']])
+        result['seconds'] = time.perf_counter() - start
+        results[rule['column']] = result
+    return results
+
+
+def failed_rules(results: dict):
+    return {column: result for column, result in results.items() if not result['passed']}
@@ -0,0 +1,79 @@
+import os
+import re
+import glob
+import shutil
+import hashlib
+import pandas as pd
+from csv_cache import file_fingerprint
+
+try:
+    import pyarrow as pa
+except ImportError:
+    pa = None
+
+
+# Settings that change what the stages produce, a different value gives new checkpoints like a code change does.
+RESULT_SETTINGS = ['MAX_FIX_ITERATIONS']
+
+# <input sha256>-<code and settings hash>, the only entries of CHECKPOINT_DIR that are ever removed.
+KEY_PATTERN = re.compile(r'^[0-9a-f]{16}-[0-9a-f]{16}$')
+
+
+def code_version():
+    # Any change to the cleaning code, schema, rules or RESULT_SETTINGS gives new checkpoints.
+    digest = hashlib.sha256()
+    for path in sorted(glob.glob(os.path.join(os.path.dirname(os.path.abspath(__file__)), '*.py'))):
+        with open(path, 'rb') as f:
+            digest.update(f.read())
+    for setting in RESULT_SETTINGS:
+        digest.update(f'{setting}={os.getenv(setting, "")}'.encode())
+    return digest.hexdigest()
+
+
+def checkpoint_dir(file_path: str):
+    # CHECKPOINT_DIR should sit on storage that outlives the pod. Checkpoints are off when it is not set.
+    # Checkpoints of other inputs or code versions are removed, anything else in the directory is left alone.
+    root = os.getenv("CHECKPOINT_DIR", "")
+    if not root or pa is None:
+        return None
+    key = f"{file_fingerprint(file_path)['sha256'][:16]}-{code_version()[:16]}"
+    directory = os.path.join(root, key)
+    os.makedirs(root, exist_ok=True)
+    for other in os.listdir(root):
+        if other != key and KEY_PATTERN.match(other) and os.path.isdir(os.path.join(root, other)):
+            shutil.rmtree(os.path.join(root, other), ignore_errors=True)
+    os.makedirs(directory, exist_ok=True)
+    return directory
+
+
+def checkpoint_path(directory: str, position: int, stage: str):
+    return os.path.join(directory, f'{position:02d}-{stage}.arrow')
+
+
+def save_checkpoint(directory: str, position: int, stage: str, df: pd.DataFrame):
+    if directory is None:
+        return
+    # The index is kept, duplicate groups refer to row numbers.
+    table = pa.Table.from_pandas(df, preserve_index=True)
+    path = checkpoint_path(directory, position, stage)
+    with pa.OSFile(path + '.tmp', 'wb') as sink:
+        with pa.ipc.new_file(sink, table.schema) as writer:
+            writer.write_table(table)
+    os.replace(path + '.tmp', path)
+
+
+def load_latest_checkpoint(directory: str, stages: list):
+    # Returns the position of the first stage still to run and the frame to run it on.
+    if directory is None:
+        return 0, None
+    for position in reversed(range(len(stages))):
+        path = checkpoint_path(directory, position, stages[position])
+        if os.path.exists(path):
+            print(f'Resuming after the {stages[position]} stage from {path}')
+            return position + 1, pa.ipc.open_file(pa.memory_map(path)).read_all().to_pandas()
+    return 0, None
+
+
+def clear_checkpoints(directory: str):
+    if directory is not None:
+        shutil.rmtree(directory, ignore_errors=True)
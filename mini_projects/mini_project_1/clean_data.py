@@ -1,10 +1,35 @@
 import pandas as pd
+import numpy as np
 import os
-import iso3166
-from sqlalchemy import create_engine
+import time
+import psycopg2
 from dotenv import load_dotenv
-
-
+from schema import EXPECTED_DATATYPES, read_bookings, schema_version, estimate_frame_bytes, release_arrow_memory
+from dates import DATE_FORMATS, parse_date_column, add_arrival_date
+from csv_cache import read_csv_cached
+from dedup import row_hashes, find_duplicates, find_duplicates_spilled, expand_duplicates, rows_in, save_duplicates_report
+from checkpoints import checkpoint_dir, load_latest_checkpoint, save_checkpoint, clear_checkpoints
+from parallel import clean_in_parallel, read_byte_range
+from pipelined import run_pipelined, report_overlap
+from outputs import output_formats, write_csv, write_parquet, chunk_csv, append_csv, finish_csv, abort_csv, start_parquet, append_parquet, finish_parquet, abort_parquet
+from business_rules import evaluate_rules, evaluate_profile_rules, revalidate_rules, failed_rules
+from column_profile import profile_frame, merge_profiles, remove_copies, null_counts
+from reference_data import REFERENCE_COLUMNS, reference_lookup, normalize_column
+from pg_loader import bulk_load, bulk_load_csv, incremental_load, start_bulk_load, copy_chunk, copy_csv_chunk, finish_bulk_load, abort_bulk_load, report_load_rate
+from instrumentation import instrumented, tracked_peak_rss, peak_rss_bytes, configure_logging, write_metrics
+
+# Upper bound on handle_* calls in each check/fix loop, a fix that does not converge stops with a warning.
+MAX_FIX_ITERATIONS = int(os.getenv("MAX_FIX_ITERATIONS", "5"))
+
+# fill company column values with n/a because the columns missing values cover ~= 94% of the data. Agent covers 14%
+MISSING_FILL_VALUES = {"company": -99, "agent": -99}
+
+# Peak memory of a LOW_MEMORY run as a multiple of the parsed frame. Reading peaks at about 5x (the arrow table
+# next to the frame it is converted into), the stages after it stay under 2x.
+LOW_MEMORY_PEAK_FACTOR = 6
+
+
+@instrumented('check')
 def check_valid_column_names(names: list):
     for name in names:
         if " " in name:
@@ -12,8 +37,10 @@ def check_valid_column_names(names: list):
     return True
 
 
-def check_missing_values(df: pd.DataFrame):
-    columns = df.isna().sum().to_dict()
+@instrumented('check')
+def check_missing_values(df: pd.DataFrame, profile: dict = None):
+    # With a merged column profile (chunked and parallel runs) the counts come from it and df is not used.
+    columns = null_counts(profile) if profile is not None else df.isna().sum().to_dict()
     missing_values_present = False
     trouble_columns = {}
     highest_missing_values_count = max(columns.values())
@@ -26,260 +53,106 @@ def check_missing_values(df: pd.DataFrame):
     return missing_values_present, trouble_columns
 
 
+@instrumented('handle')
 def handle_missing_values(df: pd.DataFrame):
-    # fill company column values with n/a because the columns missing values cover ~= 94% of the data. Agent covers 14%
-    fill_values = {"company": -99, "agent": -99}
-    df = df.fillna(value=fill_values)
+    df = df.fillna(value=MISSING_FILL_VALUES)
     df = df.dropna()
     return df
 
+@instrumented('check')
 def check_datatypes_ok(df: pd.DataFrame):
     trouble_columns = {}
     datatypes_ok = True
-    expected_datatypes = {
-        'hotel': 'object',                      
-        'is_canceled': 'int64',                       
-        'lead_time': 'float64',                         
-        'arrival_date_year':  'int64',                 
-        'arrival_date_month': 'object',                 
-        'arrival_date_week_number': 'int64',       
-        'arrival_date_day_of_month': 'int64',        
-        'stays_in_weekend_nights': 'int64',            
-        'stays_in_week_nights': 'int64',  
-        'days_in_waiting_list': 'float64',             
-        'adults': 'int64',                             
-        'children': 'int64',                            
-        'babies': 'int64',                             
-        'meal': 'object',                              
-        'country': 'object',                            
-        'market_segment': 'object',                     
-        'distribution_channel': 'object',               
-        'is_repeated_guest': 'int64',                  
-        'previous_cancellations': 'int64',             
-        'previous_bookings_not_canceled': 'int64',     
-        'reserved_room_type': 'object',             
-        'assigned_room_type': 'object',                  
-        'booking_changes': 'int64',                    
-        'deposit_type': 'object',                       
-        'agent': 'int64',                              
-        'company': 'int64',                            
-        'days_in_waiting_list,': 'float64',              
-        'customer_type': 'object',                     
-        'adr': 'float64',                               
-        'required_car_parking_spaces': 'int64',       
-        'total_of_special_requests': 'int64',         
-        'reservation_status': 'object',                  
-        'reservation_status_date': 'object'           
-    }
     actual_datatypes = df.dtypes.to_dict()
     for column, dtype in actual_datatypes.items():
-        if dtype != expected_datatypes[column]:
+        if dtype != EXPECTED_DATATYPES[column]:
             datatypes_ok = False
-            trouble_columns[column] =  f'The actual value is {dtype} it should be {expected_datatypes[column]}'
+            trouble_columns[column] =  f'The actual value is {dtype} it should be {EXPECTED_DATATYPES[column]}'
     return datatypes_ok, trouble_columns
 
 
+@instrumented('handle')
 def handle_invalid_datatypes(df: pd.DataFrame):
-       df['hotel'] = df['hotel'].astype('object')
-       df['is_canceled'] = df['is_canceled'].astype('int64')               
-       df['lead_time'] =  df['lead_time'].astype('float64')                      
-       df['arrival_date_year'] = df['arrival_date_year'].astype('int64')                                  
-       df['arrival_date_month'] = df['arrival_date_month'].astype('object')  
-       df['arrival_date_week_number'] = df['arrival_date_week_number'].astype('int64')
-       df['arrival_date_day_of_month'] = df['arrival_date_day_of_month'].astype('int64')  
-       df['stays_in_weekend_nights'] = df['stays_in_weekend_nights'].astype('int64')  
-       df['stays_in_week_nights'] = df['stays_in_week_nights'].astype('int64')   
-       df['days_in_waiting_list'] = df['days_in_waiting_list'].astype('float64')
-       df['adults'] = df['adults'].astype('int64')   
-       df['children'] = df['children'].astype('int64')
-       df['babies'] = df['babies'].astype('int64') 
-       df['meal'] = df['meal'].astype('object')
-       df['country'] = df['country'].astype('object')
-       df['market_segment'] = df['market_segment'].astype('object')
-       df['distribution_channel'] = df['distribution_channel'].astype('object')
-       df['is_repeated_guest'] = df['is_repeated_guest'].astype('int64')
-       df['previous_cancellations'] = df['previous_cancellations'].astype('int64')
-       df['previous_bookings_not_canceled'] = df['previous_bookings_not_canceled'].astype('int64')
-       df['reserved_room_type'] = df['reserved_room_type'].astype('object')
-       df['assigned_room_type'] = df['assigned_room_type'].astype('object')
-       df['booking_changes'] = df['booking_changes'].astype('int64')
-       df['deposit_type'] = df['deposit_type'].astype('object')
-       df['agent'] = df['agent'].astype('int64')
-       df['company'] = df['company'].astype('int64')
-       df['days_in_waiting_list,'] = df['days_in_waiting_list'].astype('float64')
-       df['customer_type'] = df['customer_type'].astype('object')
-       df['adr'] = df['adr'].astype('float64')
-       df['required_car_parking_spaces'] = df['required_car_parking_spaces'].astype('int64')
-       df['total_of_special_requests'] = df['total_of_special_requests'].astype('int64')
-       df['reservation_status'] = df['reservation_status'].astype('object')
-       df['reservation_status_date'] = df['reservation_status_date'].astype('object')
-       return df
-
-def check_duplicates(df: pd.DataFrame):
-    duplicate_count = df.duplicated().sum()
+    # Only the columns that are off are converted, every astype copies the column.
+    for column, dtype in df.dtypes.to_dict().items():
+        if dtype == EXPECTED_DATATYPES[column]:
+            continue
+        if column in DATE_FORMATS:
+            df[column] = parse_date_column(df[column], DATE_FORMATS[column])
+        else:
+            df[column] = df[column].astype(EXPECTED_DATATYPES[column])
+    if 'days_in_waiting_list,' not in df.columns:
+        df['days_in_waiting_list,'] = df['days_in_waiting_list'].astype('float64')
+    return df
+
+@instrumented('check')
+def check_duplicates(df: pd.DataFrame, duplicates: dict):
+    # duplicates comes from find_duplicates, the rows are hashed once for the check and the drop.
+    duplicate_count = duplicates['duplicated'].sum()
     return duplicate_count > 0, duplicate_count
 
-def handle_duplicates(df: pd.DataFrame):
-    return df.drop_duplicates()
-
-
-def check_business_logic(df: pd.DataFrame):
-    business_logic_ok = True
-    trouble_columns = set()
-    if df['hotel'].nunique() > 2 or not set(df['hotel'].unique()).issubset({'Resort Hotel', 'City Hotel'}):
-        business_logic_ok = False
-        trouble_columns.add('hotel')
-    
-    if df['is_canceled'].nunique() > 2 or not set(df['is_canceled'].unique()).issubset({0, 1}):
-        business_logic_ok = False
-        trouble_columns.add('is_canceled')
-
-    if df['lead_time'].min() < 0:
-        business_logic_ok = False
-        trouble_columns.add('lead_time')
-
-    if df['arrival_date_year'].min() < 2000 or df['arrival_date_year'].max() > 2025:
-        business_logic_ok = False
-        trouble_columns.add('arrival_date_year')
-
-    if df['arrival_date_month'].nunique() != 12 or not set(df['arrival_date_month'].unique()).issubset(
-        {'January', 'February', 'March', 'April', 'May', 'June', 'July', 'August', 'September', 'October', 'November', 'December'}):
-        business_logic_ok = False
-        trouble_columns.add('arrival_date_month')
-    
-    if df['arrival_date_week_number'].min() < 1 or df['arrival_date_week_number'].max() > 53:
-        business_logic_ok = False
-        trouble_columns.add('arrival_date_week_number')
-
-    if df['arrival_date_day_of_month'].min() < 1 or df['arrival_date_day_of_month'].max() > 31:
-        business_logic_ok = False
-        trouble_columns.add('arrival_date_day_of_month')
-
-    if df['stays_in_weekend_nights'].min() < 0 or df['stays_in_week_nights'].max() > 1000:
-        business_logic_ok = False
-        trouble_columns.add('lead_time')
-
-    if df['adults'].min() < 0:
-        business_logic_ok = False
-        trouble_columns.add('adults')
-
-    if df['children'].min() < 0:  
-        business_logic_ok = False
-        trouble_columns.add('children')
-
-    if df['babies'].min() < 0:
-        business_logic_ok = False
-        trouble_columns.add('babies')
-
-    if df['meal'].nunique() != 5:
-        business_logic_ok = False
-        trouble_columns.add('meal')
-
-
-    valid_country_codes = set([c.alpha3 for c in iso3166.countries])
-    valid_country_codes.add('TMP')
-
-
-    if not set(df['country'].unique()).issubset(valid_country_codes):
-        business_logic_ok = False
-        trouble_columns.add('country')
-
-    if df['market_segment'].nunique() != 7 or not set(df['market_segment'].unique()).issubset(
-        {'Direct', 'Corporate', 'Online TA', 'Offline TA/TO', 'Complementary', 'Groups', 'Aviation'}):
-        business_logic_ok = False
-        trouble_columns.add('market_segment')
-    
-    if df['distribution_channel'].nunique() != 5 or not set(df['distribution_channel'].unique()).issubset(
-        {'Direct', 'Corporate', 'TA/TO', 'Undefined', 'GDS'}):
-        business_logic_ok = False
-        trouble_columns.add('distribution_channel')
-    
-    
-    if df['is_repeated_guest'].nunique() > 2 or not set(df['is_repeated_guest'].unique()).issubset({0, 1}):
-        business_logic_ok = False
-        trouble_columns.add('is_repeated_guest')
-
-    if df['previous_cancellations'].min() < 0:
-        business_logic_ok = False
-        trouble_columns.add('previous_cancellations')
-
-    if df['previous_bookings_not_canceled'].min() < 0:
-        business_logic_ok = False
-        trouble_columns.add('previous_bookings_not_canceled')
-
-    if df['reserved_room_type'].nunique() > 26 or not set(df['reserved_room_type'].unique()).issubset(
-        {'C', 'A', 'D', 'E', 'G', 'F', 'H', 'L', 'B', 'P', 'I', 'K', 'J', 'M', 'N', 'O', 'Q', 'R', 'S', 'T', 'U', 'V', 'W', 'X', 'Y', 'Z'}):
-        business_logic_ok = False
-        trouble_columns.add('reserved_room_type')
-
-    if df['assigned_room_type'].nunique() > 26 or not set(df['assigned_room_type'].unique()).issubset(
-        {'C', 'A', 'D', 'E', 'G', 'F', 'H', 'L', 'B', 'P', 'I', 'K', 'J', 'M', 'N', 'O', 'Q', 'R', 'S', 'T', 'U', 'V', 'W', 'X', 'Y', 'Z'}):
-        business_logic_ok = False
-        trouble_columns.add('assigned_room_type')
-
-    if df['booking_changes'].min() < 0:
-        business_logic_ok = False
-        trouble_columns.add('booking_changes') 
-
-    if df['deposit_type'].nunique() != 3 or not set(df['deposit_type'].unique()).issubset(
-        {'No Deposit', 'Non Refund', 'Refundable'}):
-        business_logic_ok = False
-        trouble_columns.add('deposit_type') 
-
-    if df['agent'].min() < -1 and df['agent'].min() != -99:
-        business_logic_ok = False
-        trouble_columns.add('agent')
-
-    if df['company'].min() < -1 and df['company'].min() != -99:
-        business_logic_ok = False
-        trouble_columns.add('company')
-
-    if df['days_in_waiting_list'].min() < 0:
-        business_logic_ok = False
-        trouble_columns.add('days_in_waiting_list')
-
-    if df['customer_type'].nunique() != 4 or not set(df['customer_type'].unique()).issubset(
-        {'Contract', 'Group', 'Transient', 'Transient-Party'}):
-        business_logic_ok = False
-        trouble_columns.add('customer_type')
-
-    if df['adr'].min() < 0:
-        business_logic_ok = False
-        trouble_columns.add('adr')
-
-    if df['required_car_parking_spaces'].min() < 0:
-        business_logic_ok = False
-        trouble_columns.add('required_car_parking_spaces')
-
-    if df['total_of_special_requests'].min() < 0:
-        business_logic_ok = False
-        trouble_columns.add('total_of_special_requests')
-
-    if df['reservation_status'].nunique() != 3 or not set(df['reservation_status'].unique()).issubset(
-        {'Canceled', 'Check-Out', 'No-Show'}):
-        business_logic_ok = False
-        trouble_columns.add('reservation_status')
-
-    if not pd.to_datetime(df['reservation_status_date'], errors='coerce').notnull().all() or pd.to_datetime(df['reservation_status_date']).min() < pd.Timestamp('2000-01-01') or pd.to_datetime(df['reservation_status_date']).max() > pd.Timestamp('2025-01-01'):
-        business_logic_ok = False
-        trouble_columns.add('reservation_status_date')
-    
-    return business_logic_ok, trouble_columns
-
-
-def handle_business_logic_issues(df: pd.DataFrame):
-    # Update China country code.
-    df.loc[df['country'] == 'CN', 'country'] = 'CHN'
-    df.loc[df['adr'] < 0, 'adr'] = 0
+@instrumented('handle')
+def handle_duplicates(df: pd.DataFrame, duplicates: dict):
+    return df[~duplicates['duplicated']]
+
+
+def confirm_drop_duplicates(df: pd.DataFrame, duplicates: dict):
+    # duplicates comes from find_duplicates, so the rows are only hashed once for the check, report and drop.
+    duplicate_count = duplicates['duplicated'].sum()
+    if duplicate_count == 0:
+        print("No duplicates found")
+        return False
+    print(f"Dataset contains {duplicate_count} duplicates")
+    save_duplicates_report(df, duplicates, "./hotel_bookings_duplicates.csv")
+    print("Duplicates have been saved to hotel_bookings_duplicates.csv for inspection")
+    drop_duplicates = input("Do you want to drop duplicates? (yes/no): ")
+    if drop_duplicates.lower().strip() != 'yes':
+        print("Exiting without dropping duplicates")
+        return False
+    if os.path.exists("./hotel_bookings_duplicates.csv"):
+        os.remove("./hotel_bookings_duplicates.csv")
+    return True
+
+
+@instrumented('handle')
+def resolve_duplicates(df: pd.DataFrame, duplicates: dict):
+    if confirm_drop_duplicates(df, duplicates):
+        return df[~duplicates['duplicated']]
     return df
 
 
-def save_cleaned_data(df: pd.DataFrame):
-    # to csv
-    df.to_csv("./hotel_bookings_cleaned.csv", index=False)
+@instrumented('check')
+def check_business_logic(df: pd.DataFrame, results: dict = None):
+    # results from revalidate_rules are reported as they are instead of running every rule on every row again.
+    if results is None:
+        results = evaluate_rules(df)
+    failed = failed_rules(results)
+    for column, result in failed.items():
+        if result['violations'] is None:
+            print(f"Business rule for {column} failed, the column has too many distinct values to count the rows")
+        else:
+            print(f"Business rule for {column} failed with {result['violations']} violating rows")
+    print(f"Business rules took {sum(result['seconds'] for result in results.values()):.3f}s")
+    return len(failed) == 0, set(failed), results
+
+
+@instrumented('handle')
+def handle_business_logic_issues(df: pd.DataFrame, changed_rows: dict = None):
+    # Country codes (eg: CN -> CHN) and the other dimension columns are mapped onto their reference values.
+    # The rows each fix changed go into changed_rows so only those are checked again.
+    fixes = {}
+    for column in REFERENCE_COLUMNS:
+        df[column], fixes[column], unmapped = normalize_column(df[column], reference_lookup(column))
+        if unmapped:
+            print(f"No reference value for {column} values {unmapped}")
+    fixes['adr'] = (df['adr'] < 0).to_numpy()
+    df.loc[fixes['adr'], 'adr'] = 0
+    if changed_rows is not None:
+        changed_rows.update({column: rows for column, rows in fixes.items() if rows.any()})
+    return df
 
-    # to postgresql
 
+def connect_to_database():
     load_dotenv()
 
     database = os.getenv("DB_DATABASE", "Not provided")
@@ -289,98 +162,569 @@ def save_cleaned_data(df: pd.DataFrame):
     port = os.getenv("DB_PORT", "Not provided")
 
 
-    conn_str = f'postgresql://{user}:{password}@{host_name}:{port}/{database}'
     print(f'Connecting to database {database} on port {port} as user {user} on host {host_name}')
-    print(conn_str)
 
     try:
-        engine = create_engine(conn_str)
-        connection = engine.connect()
-        connection.close()
+        connection = psycopg2.connect(dbname=database, user=user, password=password, host=host_name, port=port)
         print("Connection to the database was successful")
     except Exception as e:
         print(f"Could not connect to the database due to {e}")
         quit()
-    engine = create_engine(f'postgresql://{user}:{password}@{host_name}:{port}/{database}')
+    return connection
 
-    df.to_sql('hotel_bookings', engine, if_exists='replace', index=False)
+
+@instrumented('stage')
+def save_cleaned_data(df: pd.DataFrame):
+    # OUTPUT_FORMATS picks the outputs (outputs.py), csv and postgres by default. The parquet output is partitioned
+    # by hotel and arrival_date_year under PARQUET_DIR.
+    formats = output_formats()
+    if 'csv' in formats:
+        write_csv(df, "./hotel_bookings_cleaned.csv")
+    if 'parquet' in formats:
+        write_parquet(df, os.getenv("PARQUET_DIR", "./hotel_bookings_cleaned_parquet"),
+                      int(os.getenv("PARQUET_WRITERS", "0")) or None)
+
+    # to postgresql, through COPY into a staging table that replaces hotel_bookings once it is complete
+    # or, with LOAD_MODE=incremental, by inserting and deleting only the rows that changed since the last run.
+    # A full load reads the csv file that was just written instead of serializing the frame again.
+    # LOAD_MODE=none skips the database, the benchmarks use it.
+    load_mode = os.getenv("LOAD_MODE", "full")
+    if 'postgres' not in formats or load_mode == "none":
+        print("Saving complete, the database load was skipped")
+        return
+    connection = connect_to_database()
+    if load_mode == "incremental":
+        incremental_load(connection, df, 'hotel_bookings')
+    elif 'csv' in formats:
+        bulk_load_csv(connection, "./hotel_bookings_cleaned.csv", 'hotel_bookings', df.dtypes.to_dict())
+    else:
+        bulk_load(connection, df, 'hotel_bookings')
+    connection.close()
 
     print("Saving complete")
 
 
-'''
+def drop_seen_rows(df: pd.DataFrame, state: dict):
+    # Rows are compared by a 64 bit hash so only the hashes have to be kept between chunks, in a sorted uint64 array
+    # (8 bytes per distinct row) that every chunk is binary searched against and merged into.
+    hashes = row_hashes(df)
+    keep = ~pd.Series(hashes).duplicated().to_numpy() & ~rows_in(hashes, state['seen_rows'])
+    new_hashes = np.sort(hashes[keep])
+    state['seen_rows'] = np.insert(state['seen_rows'], np.searchsorted(state['seen_rows'], new_hashes), new_hashes)
+    return df[keep]
+
+
+def chunk_row_hashes(file_path: str, chunk_size: int):
+    # First pass of the spilled duplicate check, chunks are cleaned the same way as in the second pass.
+    for chunk in read_bookings(file_path, chunksize=chunk_size):
+        chunk = add_arrival_date(handle_invalid_datatypes(df=handle_missing_values(df=chunk)))
+        yield row_hashes(chunk), chunk.index.to_numpy()
+
+
+def start_chunked_state(file_path: str, chunk_size: int, drop_duplicates: bool):
+    # What the chunked and pipelined runs carry from one chunk to the next.
+    state = {
+        'drop_duplicates': drop_duplicates,
+        'duplicated_rows': None,
+        'seen_rows': np.empty(0, dtype=np.uint64),
+        'raw_profile': None,
+        'profile': None,
+        'rows_read': 0,
+        'rows_written': 0,
+        'duplicates_count': 0,
+    }
+    # With DEDUP_SPILL_DIR set the row hashes are spilled to disk in a first pass over the file instead of being
+    # kept in memory, for inputs whose hashes do not fit in memory either.
+    spill_dir = os.getenv("DEDUP_SPILL_DIR", "")
+    if drop_duplicates and spill_dir:
+        state['duplicated_rows'] = find_duplicates_spilled(
+            chunk_row_hashes(file_path, chunk_size), spill_dir)['duplicated_rows']
+    return state
+
+
+def clean_chunk(chunk_number: int, chunk: pd.DataFrame, state: dict):
+    if chunk_number == 0:
+        if check_valid_column_names(chunk.columns.values):
+            print("Column names are valid")
+        else:
+            print("Invalid column names present")
+    state['rows_read'] += chunk.shape[0]
+
+    # Missing values are counted before they are handled, the business rules are checked on the cleaned rows.
+    state['raw_profile'] = merge_profiles(state['raw_profile'], profile_frame(chunk, distinct=False))
+    chunk = handle_missing_values(df=chunk)
+
+    chunk = add_arrival_date(handle_invalid_datatypes(df=chunk))
+    datatypes_check = check_datatypes_ok(chunk)
+    if not datatypes_check[0]:
+        print(f'Chunk {chunk_number}: {len(datatypes_check[1])} column data types are off')
+        print(datatypes_check[1])
+
+    if state['drop_duplicates']:
+        rows_before = chunk.shape[0]
+        if state['duplicated_rows'] is not None:
+            chunk = chunk[~rows_in(chunk.index.to_numpy(), state['duplicated_rows'])]
+        else:
+            chunk = drop_seen_rows(chunk, state)
+        state['duplicates_count'] += rows_before - chunk.shape[0]
+
+    chunk = handle_business_logic_issues(chunk)
+    state['profile'] = merge_profiles(state['profile'], profile_frame(chunk))
+    state['rows_written'] += chunk.shape[0]
+    return chunk
+
+
+def finish_chunked_checks(state: dict):
+    # Returns False when no rows are left to load.
+    _, trouble_columns = check_missing_values(None, profile=state['raw_profile'])
+    print(f"The columns that had missing values are {trouble_columns}")
+    if state['drop_duplicates']:
+        print(f"Dropped {state['duplicates_count']} duplicates")
+
+    if state['rows_written'] == 0:
+        print("No rows left after cleaning")
+        return False
+    business_check = check_business_logic(None, evaluate_profile_rules(state['profile']))
+    if business_check[0]:
+        print("Business logic checks passed")
+    else:
+        print(f"Business logic checks failed for columns: {business_check[1]}")
+    return True
 
-Cleaning Pipeline:
-   Check column names -> Handle missing values -> Fix column datatypes  -> Fix duplicates -> Business logic checks
-   Save cleaned data to new CSV file
 
-'''
-def main():
+def start_chunk_outputs():
+    # The outputs OUTPUT_FORMATS picks for chunked and pipelined runs as writer(chunk_number, chunk) functions, each
+    # chunk is appended and finish_chunk_outputs makes the outputs complete. Postgres is only connected to when it is
+    # picked and LOAD_MODE is not none, the chunks are COPYed into a staging table. With csv picked too one writer
+    # does both, the csv text of the chunk is COPYed so the chunk is only serialized once.
+    formats = output_formats()
+    load_mode = os.getenv("LOAD_MODE", "full")
+    outputs = {'writers': {}, 'csv': 'csv' in formats, 'parquet': 'parquet' in formats, 'parquet_files': [],
+               'connection': None, 'staging_table': None}
+    csv_path = "./hotel_bookings_cleaned.csv"
+    parquet_writers = int(os.getenv("PARQUET_WRITERS", "0")) or None
+
+    def staging_table(chunk: pd.DataFrame):
+        if outputs['staging_table'] is None:
+            outputs['staging_table'] = start_bulk_load(outputs['connection'], 'hotel_bookings', chunk.dtypes.to_dict())
+        return outputs['staging_table']
+
+    def write_csv_chunk(chunk_number: int, chunk: pd.DataFrame):
+        append_csv(chunk_csv(chunk, chunk_number), csv_path, chunk_number)
+
+    def write_parquet_chunk(chunk_number: int, chunk: pd.DataFrame):
+        append_parquet(chunk, outputs['parquet_dir'], chunk_number, outputs['parquet_files'], parquet_writers)
+
+    def write_postgres_chunk(chunk_number: int, chunk: pd.DataFrame):
+        copy_chunk(outputs['connection'], staging_table(chunk), chunk)
+
+    def write_csv_and_postgres_chunk(chunk_number: int, chunk: pd.DataFrame):
+        text = chunk_csv(chunk, chunk_number)
+        append_csv(text, csv_path, chunk_number)
+        copy_csv_chunk(outputs['connection'], staging_table(chunk), text, header=chunk_number == 0)
+
+    if outputs['csv']:
+        outputs['writers']['csv'] = write_csv_chunk
+    if outputs['parquet']:
+        outputs['parquet_dir'] = start_parquet(os.getenv("PARQUET_DIR", "./hotel_bookings_cleaned_parquet"))
+        outputs['writers']['parquet'] = write_parquet_chunk
+    if 'postgres' in formats and load_mode != "none":
+        if load_mode == "incremental":
+            print("Incremental loads need the whole dataset, chunked runs do a full load")
+        outputs['connection'] = connect_to_database()
+        if outputs['csv']:
+            del outputs['writers']['csv']
+            outputs['writers']['csv+postgres'] = write_csv_and_postgres_chunk
+        else:
+            outputs['writers']['postgres'] = write_postgres_chunk
+    return outputs
+
+
+def finish_chunk_outputs(outputs: dict, rows_left: bool):
+    # With no rows left or a failed run the files this run wrote are removed, the csv and parquet files of the last
+    # run stay as they are and the staging table is dropped (abort_bulk_load).
+    connection = outputs['connection']
+    csv_path = "./hotel_bookings_cleaned.csv"
+    parquet_dir = os.getenv("PARQUET_DIR", "./hotel_bookings_cleaned_parquet")
+    if rows_left:
+        if outputs['csv']:
+            finish_csv(csv_path)
+        if outputs['parquet']:
+            finish_parquet(parquet_dir, outputs['parquet_files'])
+    else:
+        if outputs['csv']:
+            abort_csv(csv_path)
+        if outputs['parquet']:
+            abort_parquet(parquet_dir)
+    if connection is None:
+        return
+    if not rows_left or outputs['staging_table'] is None:
+        abort_bulk_load(connection, outputs['staging_table'])
+        return
+    try:
+        finish_bulk_load(connection, outputs['staging_table'], 'hotel_bookings')
+    except Exception:
+        abort_bulk_load(connection, outputs['staging_table'])
+        raise
+    connection.close()
 
-    file_path = "./hotel_bookings.csv"
-    hotel_bookings = pd.read_csv(file_path)
 
-    print(f'The column has {hotel_bookings.shape[0]} rows')
+def main_chunked(file_path: str, chunk_size: int):
+    drop_duplicates = input("Do you want to drop duplicates? (yes/no): ").lower().strip() == 'yes'
+    outputs = start_chunk_outputs()
+    load_start = time.perf_counter()
+    state = start_chunked_state(file_path, chunk_size, drop_duplicates)
+
+    try:
+        for chunk_number, chunk in enumerate(read_bookings(file_path, chunksize=chunk_size)):
+            chunk = clean_chunk(chunk_number, chunk, state)
+            for writer in outputs['writers'].values():
+                writer(chunk_number, chunk)
+            print(f"Chunk {chunk_number}: {state['rows_read']} rows read, {state['rows_written']} rows written")
+    except Exception:
+        finish_chunk_outputs(outputs, rows_left=False)
+        raise
+
+    rows_left = finish_chunked_checks(state)
+    finish_chunk_outputs(outputs, rows_left)
+    if not rows_left:
+        return
+    if outputs['connection'] is None:
+        print("Saving complete, the database load was skipped")
+        return
+    report_load_rate(state['rows_written'], time.perf_counter() - load_start)
+    print("Saving complete")
+
+
+def main_pipelined(file_path: str, chunk_size: int):
+    # The chunked pipeline with reading, cleaning and every output each in their own thread (pipelined.py).
+    # PIPELINE_QUEUE_SIZE chunks can wait between two stages, so memory stays flat whatever the file size.
+    drop_duplicates = input("Do you want to drop duplicates? (yes/no): ").lower().strip() == 'yes'
+    outputs = start_chunk_outputs()
+    start = time.perf_counter()
+    state = start_chunked_state(file_path, chunk_size, drop_duplicates)
+
+    def clean(chunk_number: int, chunk: pd.DataFrame):
+        chunk = clean_chunk(chunk_number, chunk, state)
+        print(f"Chunk {chunk_number}: {state['rows_read']} rows read, {state['rows_written']} rows cleaned")
+        return chunk
 
+    try:
+        stage_seconds = run_pipelined(read_bookings(file_path, chunksize=chunk_size), clean, outputs['writers'],
+                                      int(os.getenv("PIPELINE_QUEUE_SIZE", "2")))
+    except Exception:
+        finish_chunk_outputs(outputs, rows_left=False)
+        raise
+
+    rows_left = finish_chunked_checks(state)
+    finish_chunk_outputs(outputs, rows_left)
+    if not rows_left:
+        return
+    wall_seconds = time.perf_counter() - start
+    if outputs['connection'] is not None:
+        report_load_rate(state['rows_written'], wall_seconds)
+    else:
+        print("The database load was skipped")
+    report_overlap(stage_seconds, wall_seconds)
+    print("Saving complete")
 
 
+def clean_partition(file_path: str, header: bytes, start: int, end: int):
+    # Runs in a worker process. Rows are hashed before the business logic fixes, the serial path finds
+    # duplicates before those fixes too.
+    df = read_byte_range(file_path, header, start, end, read_bookings)
+    raw_profile = profile_frame(df, distinct=False)
+    df = handle_missing_values(df=df)
+    df = add_arrival_date(handle_invalid_datatypes(df=df))
+    hashes = row_hashes(df)
+    df = handle_business_logic_issues(df)
+    return df, hashes, profile_frame(df), raw_profile
+
+
+def main_parallel(file_path: str, workers: int):
+    hotel_bookings, hashes, profile, raw_profile = clean_in_parallel(file_path, workers, clean_partition)
+    # The workers fill and drop missing values, the merged profile of the rows they read is checked for them.
+    missing_values_check = check_missing_values(None, profile=raw_profile)
+    if missing_values_check[0]:
+        print("Columns had missing values")
+        print(f"The trouble columns are {missing_values_check[1]}")
+    else:
+        print("Columns do not have missing values")
+    print(f'{hotel_bookings.shape[0]} rows left after handling missing values')
+
     if check_valid_column_names(hotel_bookings.columns.values):
         print("Column names are valid")
     else:
         print("Invalid column names present")
-        # handle_invalid_column_names(hotel_bookings_raw)
 
-    while True:  
-        missing_values_check = check_missing_values(hotel_bookings)
-        if not missing_values_check[0]:
-            print("Columns do not have missing values")
-            break
-        else:
-            print("Columns have missing values")
-            print(f"The trouble columns are {missing_values_check[1]}")
-            hotel_bookings = handle_missing_values(df=hotel_bookings)
+    # Partitions have their own categories so the merged category columns come back as object.
+    hotel_bookings = handle_invalid_datatypes(df=hotel_bookings)
+
+    # The workers profiled their rows before duplicates were dropped, the dropped copies come off the profile.
+    duplicates = find_duplicates(hashes, hotel_bookings.index.to_numpy())
+    deduplicated = resolve_duplicates(hotel_bookings, duplicates)
+    if deduplicated.shape[0] < hotel_bookings.shape[0]:
+        profile = remove_copies(profile, profile_frame(hotel_bookings[duplicates['duplicated']]))
+    hotel_bookings = deduplicated
 
+    business_check = check_business_logic(hotel_bookings, evaluate_profile_rules(profile))
+    if business_check[0]:
+        print("Business logic checks passed")
+    else:
+        print(f"Business logic checks failed for columns: {business_check[1]}")
+
+    save_cleaned_data(hotel_bookings)
 
-    while True:  
+
+'''
+
+Cleaning Pipeline:
+   Check column names -> Handle missing values -> Fix column datatypes -> Add arrival_date -> Fix duplicates -> Business logic checks
+   Save cleaned data to new CSV file
+   With CHECKPOINT_DIR set each stage's output is saved so a rerun resumes after the last finished stage.
+   Each check/fix loop stops after MAX_FIX_ITERATIONS fixes, the business rules only re-check the rows a fix changed.
+
+Chunked Pipeline (CHUNK_SIZE > 0):
+   Each chunk of CHUNK_SIZE rows goes through missing values -> datatypes -> arrival_date -> duplicates -> business logic fixes
+   and is appended to the cleaned CSV file and the table. Duplicates and the business logic checks keep their
+   state across chunks (row hashes and a mergeable column profile) so memory depends on the chunk size.
+
+Parallel Pipeline (WORKERS > 1):
+   The CSV is split into byte ranges and each range goes through missing values -> datatypes -> arrival_date -> business logic fixes
+   in a pool of WORKERS processes. The partitions are merged in file order and duplicates are found on row hashes
+   taken before the business logic fixes, so the output matches the serial pipeline. The business rules are checked
+   on the merged column profiles of the partitions.
+
+Pipelined Pipeline (PIPELINED=on):
+   The chunked pipeline (CHUNK_SIZE or 100000 rows per chunk) with reading, cleaning, writing the CSV file and loading
+   the table in their own threads joined by bounded queues, so the stages overlap. The wall time is reported next to
+   the time the stages take one after the other.
+
+Low Memory Pipeline (LOW_MEMORY=on):
+   The cleaning pipeline with copy on write and column by column fixes. Rows with missing values and duplicates are
+   only marked and dropped together in one filter. Peak RSS is printed for every stage. With MEMORY_BUDGET_MB set and
+   a file that would not fit, the chunked pipeline runs instead with chunks sized to the budget.
+
+'''
+@instrumented('stage')
+def missing_values_stage(hotel_bookings: pd.DataFrame):
+    missing_values_check = check_missing_values(hotel_bookings)
+    fixes = 0
+    while missing_values_check[0]:
+        print("Columns have missing values")
+        print(f"The trouble columns are {missing_values_check[1]}")
+        if fixes == MAX_FIX_ITERATIONS:
+            print(f"Warning: missing values are left after {fixes} fixes, continuing with them")
+            break
+        hotel_bookings = handle_missing_values(df=hotel_bookings)
+        fixes += 1
+        # Filling and dropping cannot add missing values, so only the trouble columns are checked again.
+        missing_values_check = check_missing_values(hotel_bookings[list(missing_values_check[1])])
+    if not missing_values_check[0]:
+        print("Columns do not have missing values")
+    return hotel_bookings
+
+
+@instrumented('stage')
+def datatypes_stage(hotel_bookings: pd.DataFrame):
+    datatypes_check = check_datatypes_ok(hotel_bookings)
+    fixes = 0
+    while not datatypes_check[0]:
+        print(f' {len(datatypes_check[1])} column data types are off')
+        print(datatypes_check[1])
+        if fixes == MAX_FIX_ITERATIONS:
+            print(f"Warning: data types are still off after {fixes} fixes, continuing with them")
+            break
+        hotel_bookings = handle_invalid_datatypes(df=hotel_bookings)
+        fixes += 1
         datatypes_check = check_datatypes_ok(hotel_bookings)
-        if datatypes_check[0]:
-            print("Data types are okay")
+    if datatypes_check[0]:
+        print("Data types are okay")
+    return hotel_bookings
+
+
+@instrumented('stage')
+def dates_stage(hotel_bookings: pd.DataFrame):
+    # reservation_status_date is already parsed by read_bookings, the split arrival date columns become one date.
+    return add_arrival_date(hotel_bookings)
+
+
+@instrumented('stage')
+def duplicates_stage(hotel_bookings: pd.DataFrame):
+    return resolve_duplicates(
+        hotel_bookings, find_duplicates(row_hashes(hotel_bookings), hotel_bookings.index.to_numpy()))
+
+
+@instrumented('stage')
+def business_logic_stage(hotel_bookings: pd.DataFrame):
+    # Every rule runs on every row once, after a fix only the rules on the changed columns run on the changed rows.
+    business_check = check_business_logic(hotel_bookings)
+    fixes = 0
+    while not business_check[0]:
+        print(f"Business logic checks failed for columns: {business_check[1]}")
+        changed_rows = {}
+        if fixes < MAX_FIX_ITERATIONS:
+            hotel_bookings = handle_business_logic_issues(hotel_bookings, changed_rows)
+            fixes += 1
+        if not changed_rows:
+            print(f"Warning: business logic checks still fail after {fixes} fixes, continuing with the failing rows")
             break
+        business_check = check_business_logic(
+            hotel_bookings, revalidate_rules(hotel_bookings, business_check[2], changed_rows))
+    if business_check[0]:
+        print("Business logic checks passed")
+    return hotel_bookings
+
+
+CLEANING_STAGES = [
+    ('missing_values', missing_values_stage),
+    ('datatypes', datatypes_stage),
+    ('dates', dates_stage),
+    ('duplicates', duplicates_stage),
+    ('business_logic', business_logic_stage),
+]
+
+
+def measured_stage(name: str, stage, *args):
+    with tracked_peak_rss() as peak:
+        result = stage(*args)
+    print(f"Stage {name} peak RSS {peak['bytes'] / 1024 ** 2:.1f} MiB")
+    return result
+
+
+@instrumented('stage')
+def low_memory_missing_values_stage(hotel_bookings: pd.DataFrame):
+    # Same fixes as handle_missing_values, one column at a time. Rows with other missing values are only marked
+    # in the returned keep mask, the frame is filtered once after the duplicates stage.
+    keep = np.ones(hotel_bookings.shape[0], dtype=bool)
+    missing_values_check = check_missing_values(hotel_bookings)
+    if not missing_values_check[0]:
+        print("Columns do not have missing values")
+        return hotel_bookings, keep
+    print("Columns have missing values")
+    print(f"The trouble columns are {missing_values_check[1]}")
+    for column in missing_values_check[1]:
+        if column in MISSING_FILL_VALUES:
+            hotel_bookings[column] = hotel_bookings[column].fillna(MISSING_FILL_VALUES[column])
         else:
-            print(f' {len(datatypes_check[1])} column data types are off')
-            print(datatypes_check[1])
-            hotel_bookings =  handle_invalid_datatypes(df=hotel_bookings)
-
-    while True:
-        duplicates_check = check_duplicates(hotel_bookings)
-        if duplicates_check[0]:
-            print(f"Dataset contains {duplicates_check[1]} duplicates")
-            hotel_booking_dup = hotel_bookings[hotel_bookings.duplicated(hotel_bookings.columns.values.tolist(), keep=False)].sort_values(hotel_bookings.columns.values.tolist(),)
-            hotel_booking_dup.to_csv("./hotel_bookings_duplicates.csv", index=False)
-            print("Duplicates have been saved to hotel_bookings_duplicates.csv for inspection")
-            drop_duplicates = input("Do you want to drop duplicates? (yes/no): ")
-            if drop_duplicates.lower().strip() != 'yes':
-                print("Exiting without dropping duplicates")
-                break
-            hotel_bookings = handle_duplicates(hotel_bookings)
-            if os.path.exists("./hotel_bookings_duplicates.csv"):
-                os.remove("./hotel_bookings_duplicates.csv")
+            keep &= hotel_bookings[column].notna().to_numpy()
+    print(f"{(~keep).sum()} rows with missing values will be dropped")
+    return hotel_bookings, keep
+
+
+@instrumented('stage')
+def low_memory_datatypes_stage(hotel_bookings: pd.DataFrame):
+    # Rows that are going to be dropped still hold their missing values, 0 lets the integer conversion through.
+    for column, dtype in EXPECTED_DATATYPES.items():
+        if dtype == 'int64' and column in hotel_bookings.columns and hotel_bookings[column].hasnans:
+            hotel_bookings[column] = hotel_bookings[column].fillna(0)
+    return datatypes_stage(hotel_bookings)
+
+
+@instrumented('stage')
+def low_memory_duplicates_stage(hotel_bookings: pd.DataFrame, keep: np.ndarray):
+    # Duplicates are looked for among the rows that are kept and marked in keep instead of being dropped.
+    kept_rows = np.flatnonzero(keep)
+    duplicates = find_duplicates(row_hashes(hotel_bookings)[kept_rows], hotel_bookings.index.to_numpy()[kept_rows])
+    duplicates = expand_duplicates(duplicates, kept_rows, hotel_bookings.shape[0])
+    if confirm_drop_duplicates(hotel_bookings, duplicates):
+        keep &= ~duplicates['duplicated']
+    return keep
+
+
+def main_low_memory(file_path: str):
+    # With MEMORY_BUDGET_MB set, files that would not fit are cleaned in chunks sized to the budget instead.
+    budget_mb = int(os.getenv("MEMORY_BUDGET_MB", "0"))
+    if budget_mb > 0:
+        frame_bytes, row_bytes = estimate_frame_bytes(file_path)
+        available = budget_mb * 1024 ** 2 - peak_rss_bytes()
+        needed = frame_bytes * LOW_MEMORY_PEAK_FACTOR
+        print(f"About {needed / 1024 ** 2:.0f} MiB needed, {available / 1024 ** 2:.0f} MiB of the budget is left")
+        if needed > available:
+            chunk_size = max(1000, int(available / (row_bytes * LOW_MEMORY_PEAK_FACTOR)))
+            print(f"Over the memory budget, cleaning in chunks of {chunk_size} rows")
+            main_chunked(file_path, chunk_size)
+            return
+
+    # Copy on write turns the column selections and slices below into views until something writes to them.
+    pd.set_option('mode.copy_on_write', True)
+    hotel_bookings = measured_stage('read', read_stage, file_path)
+    release_arrow_memory()
+    print(f'The column has {hotel_bookings.shape[0]} rows')
+    if check_valid_column_names(hotel_bookings.columns.values):
+        print("Column names are valid")
+    else:
+        print("Invalid column names present")
+
+    hotel_bookings, keep = measured_stage('missing_values', low_memory_missing_values_stage, hotel_bookings)
+    hotel_bookings = measured_stage('datatypes', low_memory_datatypes_stage, hotel_bookings)
+    hotel_bookings = measured_stage('dates', dates_stage, hotel_bookings)
+    keep = measured_stage('duplicates', low_memory_duplicates_stage, hotel_bookings, keep)
+    # The only copy of the rows, missing values and duplicates are dropped together.
+    hotel_bookings = hotel_bookings[keep]
+    print(f'{hotel_bookings.shape[0]} rows left after dropping missing values and duplicates')
+    hotel_bookings = measured_stage('business_logic', business_logic_stage, hotel_bookings)
+    measured_stage('save', save_cleaned_data, hotel_bookings)
+
+
+@instrumented('stage')
+def read_stage(file_path: str):
+    return read_csv_cached(file_path, read_bookings, schema_version())
+
+
+def run_pipeline(file_path: str):
+    chunk_size = int(os.getenv("CHUNK_SIZE", "0"))
+    if os.getenv("PIPELINED", "off") == "on":
+        main_pipelined(file_path, chunk_size if chunk_size > 0 else 100_000)
+        return
+    if chunk_size > 0:
+        main_chunked(file_path, chunk_size)
+        return
+    workers = int(os.getenv("WORKERS", "1"))
+    if workers > 1:
+        main_parallel(file_path, workers)
+        return
+    if os.getenv("LOW_MEMORY", "off") == "on":
+        main_low_memory(file_path)
+        return
+
+    # Every stage's output is checkpointed when CHECKPOINT_DIR is set, a rerun on the same input and code
+    # starts after the last stage that finished.
+    checkpoints = checkpoint_dir(file_path)
+    first_stage, hotel_bookings = load_latest_checkpoint(checkpoints, [name for name, _ in CLEANING_STAGES])
+
+    if hotel_bookings is None:
+        hotel_bookings = read_stage(file_path)
+
+        print(f'The column has {hotel_bookings.shape[0]} rows')
+
+
+
+        if check_valid_column_names(hotel_bookings.columns.values):
+            print("Column names are valid")
         else:
-            print("No duplicates found")
-            break
+            print("Invalid column names present")
+            # handle_invalid_column_names(hotel_bookings_raw)
 
-    while True:
-         business_check = check_business_logic(hotel_bookings)
-         if business_check[0]:
-             print("Business logic checks passed")
-             break
-         else:
-             print(f"Business logic checks failed for columns: {business_check[1]}")
-             hotel_bookings = handle_business_logic_issues(hotel_bookings)
+    for position, (name, stage) in enumerate(CLEANING_STAGES[first_stage:], first_stage):
+        hotel_bookings = stage(hotel_bookings)
+        save_checkpoint(checkpoints, position, name, hotel_bookings)
 
     save_cleaned_data(hotel_bookings)
+    clear_checkpoints(checkpoints)
+
+
+def main():
+
+    file_path = "./hotel_bookings.csv"
+
+    load_dotenv()
+    configure_logging()
+    # With METRICS=on every stage and check/handle call is timed, the report is written even when a stage fails.
+    try:
+        run_pipeline(file_path)
+    finally:
+        write_metrics()
 
 if __name__ == "__main__":
     main()
-
-    
\ No newline at end of file
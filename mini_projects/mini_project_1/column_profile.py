@@ -0,0 +1,138 @@
+import os
+import numpy as np
+import pandas as pd
+
+
+'''
+
+Column profile:
+   Per column statistics that can be built chunk by chunk or partition by partition and merged afterwards, so the
+   missing value and business logic checks do not need the whole frame in memory.
+      rows        -> rows profiled
+      nulls       -> missing values per column
+      min / max   -> smallest and largest value of numeric and date columns
+      counts      -> exact {value: rows} while a column has at most PROFILE_VALUE_CAP distinct values, None after
+      registers   -> HyperLogLog sketch of the distinct values, used for the distinct count once counts is None
+
+'''
+
+# Above this many distinct values a column only keeps its HyperLogLog sketch.
+PROFILE_VALUE_CAP = int(os.getenv("PROFILE_VALUE_CAP", "10000"))
+
+# 2^14 registers of one byte per column, the distinct count is off by about 0.8% (1.04 / sqrt(2^14)).
+HLL_PRECISION = 14
+HLL_REGISTERS = 1 << HLL_PRECISION
+
+
+def hash_values(values: np.ndarray):
+    # pandas hashes with a fixed key, the same value gives the same hash in every chunk and worker process.
+    return pd.util.hash_array(values)
+
+
+def bit_length(values: np.ndarray):
+    # Position of the highest set bit, split in two halves of 32 bits so the float log2 is exact.
+    high = (values >> np.uint64(32)).astype(np.float64)
+    low = (values & np.uint64(0xFFFFFFFF)).astype(np.float64)
+    with np.errstate(divide='ignore'):
+        high_bits = np.floor(np.log2(high)) + 33
+        low_bits = np.floor(np.log2(low)) + 1
+    return np.where(high > 0, high_bits, np.where(low > 0, low_bits, 0)).astype(np.uint8)
+
+
+def update_registers(registers: np.ndarray, hashes: np.ndarray):
+    # The first HLL_PRECISION bits pick the register, the register keeps the longest run of leading zeros (+ 1)
+    # seen in the rest of the bits.
+    buckets = (hashes >> np.uint64(64 - HLL_PRECISION)).astype(np.intp)
+    rest = hashes << np.uint64(HLL_PRECISION)
+    leading_zeros = np.minimum(64 - bit_length(rest), 64 - HLL_PRECISION) + 1
+    np.maximum.at(registers, buckets, leading_zeros.astype(np.uint8))
+
+
+def estimate_distinct(registers: np.ndarray):
+    alpha = 0.7213 / (1 + 1.079 / HLL_REGISTERS)
+    estimate = alpha * HLL_REGISTERS ** 2 / np.sum(np.ldexp(1.0, -registers.astype(np.int64)))
+    empty = int(np.count_nonzero(registers == 0))
+    # Few distinct values leave registers empty, counting those is more accurate there (linear counting).
+    if estimate <= 2.5 * HLL_REGISTERS and empty > 0:
+        estimate = HLL_REGISTERS * np.log(HLL_REGISTERS / empty)
+    return int(round(estimate))
+
+
+def column_sketch(column: pd.Series, distinct: bool = True):
+    # distinct=False only counts the missing values and keeps min/max, for a raw chunk that only feeds the
+    # missing value check.
+    sketch = {'nulls': int(column.isna().sum()), 'min': None, 'max': None, 'counts': None, 'registers': None}
+    if distinct:
+        value_counts = column.value_counts(dropna=True, sort=False)
+        value_counts = value_counts[value_counts > 0]
+        values = value_counts.index
+        sketch['registers'] = np.zeros(HLL_REGISTERS, dtype=np.uint8)
+        update_registers(sketch['registers'], hash_values(values.to_numpy()))
+        if len(value_counts) <= PROFILE_VALUE_CAP:
+            sketch['counts'] = dict(zip(values.tolist(), value_counts.tolist()))
+    if len(column) > sketch['nulls'] and (pd.api.types.is_numeric_dtype(column)
+                                          or pd.api.types.is_datetime64_any_dtype(column)):
+        sketch['min'] = column.min()
+        sketch['max'] = column.max()
+    return sketch
+
+
+def profile_frame(df: pd.DataFrame, distinct: bool = True):
+    return {'rows': df.shape[0], 'columns': {column: column_sketch(df[column], distinct) for column in df.columns}}
+
+
+def merge_sketches(a: dict, b: dict):
+    merged = {'nulls': a['nulls'] + b['nulls'], 'counts': None, 'registers': None}
+    for bound, pick in (('min', min), ('max', max)):
+        values = [value for value in (a[bound], b[bound]) if value is not None]
+        merged[bound] = pick(values) if values else None
+    if a['registers'] is not None and b['registers'] is not None:
+        merged['registers'] = np.maximum(a['registers'], b['registers'])
+    if a['counts'] is not None and b['counts'] is not None:
+        counts = dict(a['counts'])
+        for value, count in b['counts'].items():
+            counts[value] = counts.get(value, 0) + count
+        merged['counts'] = counts if len(counts) <= PROFILE_VALUE_CAP else None
+    return merged
+
+
+def merge_profiles(a: dict, b: dict):
+    # Either one can be None, the profile so far before the first chunk.
+    if a is None or b is None:
+        return a if b is None else b
+    columns = dict(a['columns'])
+    for column, sketch in b['columns'].items():
+        columns[column] = merge_sketches(columns[column], sketch) if column in columns else sketch
+    return {'rows': a['rows'] + b['rows'], 'columns': columns}
+
+
+def remove_copies(profile: dict, copies: dict):
+    # copies profiles rows that were dropped as exact copies of rows that stay (duplicates). Their values are all
+    # still in the data, so min/max and the distinct values stay as they are and only the counts go down.
+    columns = {}
+    for column, sketch in profile['columns'].items():
+        copy_sketch = copies['columns'][column]
+        sketch = dict(sketch, nulls=sketch['nulls'] - copy_sketch['nulls'])
+        if sketch['counts'] is not None and copy_sketch['counts'] is not None:
+            counts = dict(sketch['counts'])
+            for value, count in copy_sketch['counts'].items():
+                counts[value] -= count
+                if counts[value] <= 0:
+                    del counts[value]
+            sketch['counts'] = counts
+        else:
+            # Without the counts of the copies the counts that are left would overstate the rows.
+            sketch['counts'] = None
+        columns[column] = sketch
+    return {'rows': profile['rows'] - copies['rows'], 'columns': columns}
+
+
+def null_counts(profile: dict):
+    return {column: sketch['nulls'] for column, sketch in profile['columns'].items()}
+
+
+def distinct_count(sketch: dict):
+    # Exact while the value counts are kept, a HyperLogLog estimate after.
+    if sketch['counts'] is not None:
+        return len(sketch['counts'])
+    return estimate_distinct(sketch['registers'])
@@ -0,0 +1,74 @@
+import os
+import json
+import hashlib
+
+try:
+    import pyarrow.feather as feather
+except ImportError:
+    feather = None
+
+
+HASH_BLOCK_SIZE = 8 * 1024 * 1024
+
+
+def file_sha256(file_path: str):
+    digest = hashlib.sha256()
+    with open(file_path, 'rb') as f:
+        for block in iter(lambda: f.read(HASH_BLOCK_SIZE), b''):
+            digest.update(block)
+    return digest.hexdigest()
+
+
+def file_fingerprint(file_path: str):
+    # size and mtime are cheap to read. The content hash is only recomputed when one of them changed since the
+    # last run, a file that was touched but not changed still finds its cache through the hash.
+    stat = os.stat(file_path)
+    metadata_path = cache_path(file_path, 'json')
+    if os.path.exists(metadata_path):
+        with open(metadata_path) as f:
+            metadata = json.load(f)
+        if metadata['size'] == stat.st_size and metadata['mtime_ns'] == stat.st_mtime_ns:
+            return metadata
+    metadata = {'size': stat.st_size, 'mtime_ns': stat.st_mtime_ns, 'sha256': file_sha256(file_path)}
+    os.makedirs(os.path.dirname(metadata_path), exist_ok=True)
+    with open(metadata_path, 'w') as f:
+        json.dump(metadata, f)
+    return metadata
+
+
+def cache_path(file_path: str, suffix: str):
+    # CSV_CACHE_DIR comes from cache_dir in the etl-config config map, by default the cache sits next to the input.
+    cache_dir = os.getenv("CSV_CACHE_DIR") or os.path.dirname(os.path.abspath(file_path))
+    name = os.path.splitext(os.path.basename(file_path))[0]
+    return os.path.join(cache_dir, f'{name}.cache.{suffix}')
+
+
+def read_csv_cached(file_path: str, read_csv, version: str = ''):
+    # version identifies how read_csv parses the file (schema.schema_version), the cache is keyed by it and the
+    # file's sha256 so a schema change gives a new cache instead of a stale frame.
+    if feather is None or os.getenv("CSV_CACHE", "on") != "on":
+        return read_csv(file_path)
+
+    fingerprint = file_fingerprint(file_path)
+    key = hashlib.sha256(f"{fingerprint['sha256']}-{version}".encode()).hexdigest()
+    arrow_path = cache_path(file_path, f"{key[:16]}.arrow")
+    if os.path.exists(arrow_path):
+        print(f'Loading {file_path} from the cache in {arrow_path}')
+        # to_pandas copies the columns into the frame, the memory map only saves reading the file into a buffer first.
+        return feather.read_table(arrow_path, memory_map=True).to_pandas()
+
+    df = read_csv(file_path)
+    remove_stale_caches(file_path)
+    temporary_path = arrow_path + '.tmp'
+    feather.write_feather(df, temporary_path, compression='uncompressed')
+    os.replace(temporary_path, arrow_path)
+    print(f'Cached {file_path} in {arrow_path}')
+    return df
+
+
+def remove_stale_caches(file_path: str):
+    cache_dir = os.path.dirname(cache_path(file_path, 'arrow'))
+    prefix = os.path.basename(cache_path(file_path, ''))
+    for name in os.listdir(cache_dir):
+        if name.startswith(prefix) and name.endswith('.arrow'):
+            os.remove(os.path.join(cache_dir, name))
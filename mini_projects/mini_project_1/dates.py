@@ -0,0 +1,53 @@
+import numpy as np
+import pandas as pd
+
+
+# Text date columns of the extract and their format. They are read as category and parsed right after the read.
+DATE_FORMATS = {'reservation_status_date': '%Y-%m-%d'}
+
+MONTH_NUMBERS = {month: number for number, month in enumerate(
+    ['January', 'February', 'March', 'April', 'May', 'June', 'July', 'August', 'September', 'October', 'November',
+     'December'], 1)}
+
+
+def parse_date_column(column: pd.Series, date_format: str):
+    # A few thousand distinct dates repeat over all the rows, so only the categories are parsed and the rows
+    # take their date through the category codes. Values that do not match the format become NaT.
+    values = column if isinstance(column.dtype, pd.CategoricalDtype) else column.astype('category')
+    parsed = pd.to_datetime(values.cat.categories, format=date_format, errors='coerce').to_numpy(dtype='datetime64[ns]')
+    # -1 marks a missing value, the extra NaT at the end keeps it missing.
+    dates = np.append(parsed, np.datetime64('NaT', 'ns'))[values.cat.codes.to_numpy()]
+    return pd.Series(dates, index=column.index, name=column.name)
+
+
+def parse_dates(df: pd.DataFrame):
+    for column, date_format in DATE_FORMATS.items():
+        df[column] = parse_date_column(df[column], date_format)
+    return df
+
+
+def arrival_dates(df: pd.DataFrame):
+    # Year and month become a datetime64[M] (months since 1970) and the day is added on as days, no strings involved.
+    # Month names are looked up once per category. Unknown months and days past the end of the month give NaT.
+    months = df['arrival_date_month']
+    months = months if isinstance(months.dtype, pd.CategoricalDtype) else months.astype('category')
+    month_per_category = np.array([MONTH_NUMBERS.get(month, 0) for month in months.cat.categories] + [0])
+    month = month_per_category[months.cat.codes.to_numpy()]
+    year = df['arrival_date_year'].to_numpy(dtype='int64')
+    day = df['arrival_date_day_of_month'].to_numpy(dtype='int64')
+
+    first_of_month = ((year - 1970) * 12 + month - 1).astype('datetime64[M]')
+    dates = first_of_month.astype('datetime64[D]') + (day - 1)
+    valid = (month > 0) & (day >= 1) & (dates.astype('datetime64[M]') == first_of_month)
+    dates = dates.astype('datetime64[ns]')
+    dates[~valid] = np.datetime64('NaT', 'ns')
+    return pd.Series(dates, index=df.index, name='arrival_date')
+
+
+def add_arrival_date(df: pd.DataFrame):
+    # Placed after the columns it is built from.
+    if 'arrival_date' in df.columns:
+        df['arrival_date'] = arrival_dates(df)
+    else:
+        df.insert(df.columns.get_loc('arrival_date_day_of_month') + 1, 'arrival_date', arrival_dates(df))
+    return df
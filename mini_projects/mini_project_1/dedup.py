@@ -0,0 +1,91 @@
+import os
+import numpy as np
+import pandas as pd
+
+
+SPILL_PARTITION_BITS = 6
+
+
+def row_hashes(df: pd.DataFrame):
+    # One 64 bit hash per row, every duplicate check below works on these instead of on the rows.
+    return pd.util.hash_pandas_object(df, index=False).to_numpy()
+
+
+def find_duplicates(hashes: np.ndarray, row_numbers: np.ndarray):
+    # factorize numbers the distinct hashes in order of first appearance, so a row is the first of its group
+    # exactly when its code is higher than every code before it.
+    codes, uniques = pd.factorize(hashes)
+    first = codes > np.maximum.accumulate(np.concatenate(([-1], codes[:-1])))
+    first_rows = row_numbers[first]
+    return {
+        'duplicated': ~first,
+        'in_group': np.bincount(codes)[codes] > 1,
+        'group': first_rows[codes],
+    }
+
+
+def expand_duplicates(duplicates: dict, rows: np.ndarray, row_count: int):
+    # Spreads the result of find_duplicates on a subset of the rows (positions in rows) back over all row_count
+    # rows. Rows outside the subset are not duplicated and in no group.
+    expanded = {
+        'duplicated': np.zeros(row_count, dtype=bool),
+        'in_group': np.zeros(row_count, dtype=bool),
+        'group': np.full(row_count, -1, dtype=duplicates['group'].dtype),
+    }
+    for key, values in duplicates.items():
+        expanded[key][rows] = values
+    return expanded
+
+
+def rows_in(row_numbers: np.ndarray, sorted_rows: np.ndarray):
+    # Membership test with a binary search per row against a sorted array, the output of find_duplicates_spilled or
+    # the row hashes of the chunks seen so far.
+    if len(sorted_rows) == 0:
+        return np.zeros(len(row_numbers), dtype=bool)
+    positions = np.minimum(np.searchsorted(sorted_rows, row_numbers), len(sorted_rows) - 1)
+    return sorted_rows[positions] == row_numbers
+
+
+def save_duplicates_report(df: pd.DataFrame, duplicates: dict, path: str):
+    # Rows of every duplicate group are written together, each tagged with the row number of the first row of its
+    # group. Only the duplicate rows are ordered, the dataset itself is never sorted.
+    report = df[duplicates['in_group']]
+    groups = duplicates['group'][duplicates['in_group']]
+    order = np.argsort(groups, kind='stable')
+    report = report.iloc[order].assign(duplicate_group=groups[order])
+    report.to_csv(path, index=False)
+
+
+def spill_hashes(hash_chunks, spill_dir: str, partition_bits: int = SPILL_PARTITION_BITS):
+    # Writes (hash, row number) pairs into 2 ** partition_bits files picked by the top bits of the hash, so
+    # every row of a duplicate group lands in the same file and files can be checked one at a time.
+    os.makedirs(spill_dir, exist_ok=True)
+    paths = [os.path.join(spill_dir, f'hashes-{partition}.bin') for partition in range(2 ** partition_bits)]
+    files = [open(path, 'wb') for path in paths]
+    try:
+        for hashes, row_numbers in hash_chunks:
+            partitions = (hashes >> np.uint64(64 - partition_bits)).astype(np.int64)
+            order = np.argsort(partitions, kind='stable')
+            pairs = np.column_stack([hashes[order], row_numbers[order].astype(np.uint64)])
+            bounds = np.searchsorted(partitions[order], np.arange(len(files) + 1))
+            for partition, f in enumerate(files):
+                pairs[bounds[partition]:bounds[partition + 1]].tofile(f)
+    finally:
+        for f in files:
+            f.close()
+    return paths
+
+
+def find_duplicates_spilled(hash_chunks, spill_dir: str, partition_bits: int = SPILL_PARTITION_BITS):
+    # Out of core version of find_duplicates for inputs larger than memory. hash_chunks yields
+    # (hashes, row numbers) per chunk. Returns the sorted row numbers to drop, every row after the first of its hash.
+    duplicated_rows = []
+    for path in spill_hashes(hash_chunks, spill_dir, partition_bits):
+        pairs = np.fromfile(path, dtype=np.uint64).reshape(-1, 2)
+        os.remove(path)
+        hashes, row_numbers = pairs[:, 0], pairs[:, 1].astype(np.int64)
+        order = np.lexsort((row_numbers, hashes))
+        hashes, row_numbers = hashes[order], row_numbers[order]
+        starts = np.concatenate(([True], hashes[1:] != hashes[:-1]))
+        duplicated_rows.append(row_numbers[~starts])
+    return {'duplicated_rows': np.sort(np.concatenate(duplicated_rows))}
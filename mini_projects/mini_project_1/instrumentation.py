@@ -0,0 +1,156 @@
+import os
+import json
+import time
+import logging
+import resource
+import contextlib
+import functools
+import pandas as pd
+
+logger = logging.getLogger("clean_data")
+calls = []
+peak_stack = []
+
+
+def metrics_enabled():
+    # Read on every call instead of at import, main() loads the .env file after the modules are imported.
+    return os.getenv("METRICS", "off") == "on"
+
+
+def configure_logging():
+    # LOG_LEVEL comes from log_level in the etl-config config map.
+    logging.basicConfig(level=os.getenv("LOG_LEVEL", "INFO").upper(), format='%(asctime)s %(levelname)s %(message)s')
+
+
+def peak_rss_bytes():
+    try:
+        with open('/proc/self/status') as f:
+            for line in f:
+                if line.startswith('VmHWM:'):
+                    return int(line.split()[1]) * 1024
+    except OSError:
+        pass
+    return resource.getrusage(resource.RUSAGE_SELF).ru_maxrss * 1024
+
+
+def reset_peak_rss():
+    # Linux resets the peak RSS to the current RSS when 5 is written to clear_refs, which gives a peak per call.
+    try:
+        with open('/proc/self/clear_refs', 'w') as f:
+            f.write('5')
+    except OSError:
+        pass
+
+
+def frame_size(value):
+    # Shallow memory usage, deep=True would walk every string of the object columns.
+    if isinstance(value, pd.DataFrame):
+        return value.shape[0], int(value.memory_usage(index=True, deep=False).sum())
+    return None, None
+
+
+def first_frame(args, kwargs):
+    for value in list(args) + list(kwargs.values()):
+        if isinstance(value, pd.DataFrame):
+            return value
+    return None
+
+
+@contextlib.contextmanager
+def tracked_peak_rss():
+    # Peak RSS while the block runs, in peak['bytes'] once it is done. Blocks nest (a stage runs checks and fixes),
+    # the peak seen so far is handed to the enclosing block before the counter is reset.
+    if peak_stack:
+        peak_stack[-1] = max(peak_stack[-1], peak_rss_bytes())
+    reset_peak_rss()
+    peak_stack.append(0)
+    peak = {}
+    try:
+        yield peak
+    finally:
+        peak['bytes'] = max(peak_stack.pop(), peak_rss_bytes())
+        if peak_stack:
+            peak_stack[-1] = max(peak_stack[-1], peak['bytes'])
+
+
+def instrumented(kind: str):
+    def decorate(function):
+        @functools.wraps(function)
+        def wrapper(*args, **kwargs):
+            # With METRICS off the only cost is the env lookup.
+            if not metrics_enabled():
+                return function(*args, **kwargs)
+            rows_in, bytes_in = frame_size(first_frame(args, kwargs))
+            wall_start, cpu_start = time.perf_counter(), time.process_time()
+            with tracked_peak_rss() as peak:
+                result = function(*args, **kwargs)
+            wall_seconds = time.perf_counter() - wall_start
+            cpu_seconds = time.process_time() - cpu_start
+            rows_out, _ = frame_size(result)
+            call = {
+                'step': function.__name__,
+                'kind': kind,
+                'wall_seconds': wall_seconds,
+                'cpu_seconds': cpu_seconds,
+                'rows_in': rows_in,
+                'rows_out': rows_out,
+                'bytes_in': bytes_in,
+                'peak_rss_bytes': peak['bytes'],
+            }
+            calls.append(call)
+            logger.log(logging.INFO if kind == 'stage' else logging.DEBUG,
+                       '%s took %.3fs wall, %.3fs cpu, rows %s -> %s, peak rss %.1f MiB', function.__name__,
+                       wall_seconds, cpu_seconds, rows_in, rows_out, peak['bytes'] / 1024 ** 2)
+            return result
+        return wrapper
+    return decorate
+
+
+def summarize(step_calls: list):
+    # Steps inside the check/fix loops run several times, their numbers are added up and the peak is the highest.
+    summary = {}
+    for call in step_calls:
+        step = summary.setdefault(call['step'], {'kind': call['kind'], 'calls': 0, 'wall_seconds': 0.0,
+                                                 'cpu_seconds': 0.0, 'rows_in': 0, 'rows_out': 0, 'bytes_in': 0,
+                                                 'peak_rss_bytes': 0})
+        step['calls'] += 1
+        for key in ['wall_seconds', 'cpu_seconds', 'rows_in', 'rows_out', 'bytes_in']:
+            step[key] += call[key] or 0
+        step['peak_rss_bytes'] = max(step['peak_rss_bytes'], call['peak_rss_bytes'])
+    return summary
+
+
+def prometheus_text(summary: dict):
+    metrics = [
+        ('calls', 'Number of calls of the step in the last run'),
+        ('wall_seconds', 'Wall time of the step in the last run'),
+        ('cpu_seconds', 'CPU time of the step in the last run'),
+        ('rows_in', 'Rows handed to the step in the last run'),
+        ('rows_out', 'Rows returned by the step in the last run'),
+        ('bytes_in', 'Bytes of the frames handed to the step in the last run'),
+        ('peak_rss_bytes', 'Highest peak resident memory while the step ran'),
+    ]
+    lines = []
+    for key, help_text in metrics:
+        lines.append(f'# HELP clean_data_step_{key} {help_text}')
+        lines.append(f'# TYPE clean_data_step_{key} gauge')
+        for step, values in summary.items():
+            lines.append(f'clean_data_step_{key}{{step="{step}",kind="{values["kind"]}"}} {values[key]}')
+    return '\n'.join(lines) + '\n'
+
+
+def write_metrics():
+    # Writes run_report.json with every call and clean_data.prom for the node exporter textfile
+    # collector. Files are replaced whole so a collector never reads half a file.
+    if not metrics_enabled():
+        return
+    metrics_dir = os.getenv("METRICS_DIR", "./metrics")
+    os.makedirs(metrics_dir, exist_ok=True)
+    summary = summarize(calls)
+    report = {'finished_at': time.time(), 'steps': summary, 'calls': calls}
+    for name, content in [('run_report.json', json.dumps(report, indent=2)), ('clean_data.prom', prometheus_text(summary))]:
+        path = os.path.join(metrics_dir, name)
+        with open(path + '.tmp', 'w') as f:
+            f.write(content)
+        os.replace(path + '.tmp', path)
+    logger.info('Metrics written to %s', metrics_dir)
@@ -0,0 +1,142 @@
+import os
+import shutil
+from concurrent.futures import ThreadPoolExecutor
+import pandas as pd
+
+try:
+    import pyarrow as pa
+    import pyarrow.parquet as pq
+except ImportError:
+    pa = pq = None
+
+
+OUTPUT_FORMATS = ['csv', 'parquet', 'postgres']
+PARTITION_COLUMNS = ['hotel', 'arrival_date_year']
+# Name of the file in each partition, chunked runs write part-<chunk number>.parquet files instead.
+PARQUET_FILE_NAME = 'part-0.parquet'
+
+
+def output_formats():
+    # OUTPUT_FORMATS=csv,parquet,postgres picks what save_cleaned_data writes, csv and postgres by default.
+    formats = [name.strip() for name in os.getenv("OUTPUT_FORMATS", "csv,postgres").split(',') if name.strip()]
+    unknown = set(formats) - set(OUTPUT_FORMATS)
+    if unknown:
+        raise ValueError(f'Unknown output formats {sorted(unknown)}, pick from {OUTPUT_FORMATS}')
+    return formats
+
+
+def write_csv(df: pd.DataFrame, path: str):
+    # Written next to the old file and renamed over it, a reader never sees half a file.
+    temporary_path = path + '.tmp'
+    df.to_csv(temporary_path, index=False)
+    os.replace(temporary_path, path)
+
+
+def partition_path(directory: str, values: tuple):
+    # Hive style directories (hotel=City Hotel/arrival_date_year=2016), pyarrow, spark and duckdb prune on them.
+    return os.path.join(directory, *[f'{column}={value}' for column, value in zip(PARTITION_COLUMNS, values)])
+
+
+def write_partition(table, rows, path: str, file_name: str, compression: str):
+    os.makedirs(path, exist_ok=True)
+    file_path = os.path.join(path, file_name)
+    pq.write_table(table.take(rows), file_path + '.tmp', compression=compression)
+    os.replace(file_path + '.tmp', file_path)
+    return file_path
+
+
+def write_parquet_files(df: pd.DataFrame, directory: str, file_name: str, writers: int = None,
+                        compression: str = 'zstd'):
+    # The frame is converted to arrow once, every partition is a slice of that table. Partitions are written by a
+    # pool of threads (pyarrow compresses and writes without the GIL), each one atomically through a rename.
+    # Returns the paths of the files written.
+    table = pa.Table.from_pandas(df.drop(columns=PARTITION_COLUMNS), preserve_index=False)
+    partitions = df.groupby(PARTITION_COLUMNS, observed=True, sort=True).indices
+    with ThreadPoolExecutor(max_workers=writers or os.cpu_count()) as pool:
+        futures = [pool.submit(write_partition, table, rows, partition_path(directory, values), file_name, compression)
+                   for values, rows in partitions.items()]
+        return [future.result() for future in futures]
+
+
+def remove_stale_parquet(directory: str, written: list):
+    # Parquet files from an earlier run that this run did not write are removed, and the directories they leave empty.
+    written = {os.path.normpath(path) for path in written}
+    for root, _, files in os.walk(directory, topdown=False):
+        for name in files:
+            path = os.path.normpath(os.path.join(root, name))
+            if name.endswith('.parquet') and path not in written:
+                os.remove(path)
+        if root != directory and not os.listdir(root):
+            os.rmdir(root)
+
+
+def write_parquet(df: pd.DataFrame, directory: str, writers: int = None, compression: str = 'zstd'):
+    if pq is None:
+        print("pyarrow is not installed, the parquet output was skipped")
+        return
+    written = write_parquet_files(df, directory, PARQUET_FILE_NAME, writers, compression)
+    remove_stale_parquet(directory, written)
+    print(f'Wrote {len(written)} parquet partitions to {directory}')
+
+
+def chunk_csv(df: pd.DataFrame, chunk_number: int):
+    # The csv text of a chunk, the first chunk starts with the header. With postgres picked too the same text is
+    # COPYed, so every chunk is only serialized once.
+    return df.to_csv(index=False, header=chunk_number == 0)
+
+
+def append_csv(text: str, path: str, chunk_number: int):
+    # Chunked runs write path + '.tmp', the first chunk starts it. finish_csv renames it into place, abort_csv
+    # removes it after a failed run.
+    with open(path + '.tmp', 'w' if chunk_number == 0 else 'a', newline='') as f:
+        f.write(text)
+
+
+def finish_csv(path: str):
+    if os.path.exists(path + '.tmp'):
+        os.replace(path + '.tmp', path)
+
+
+def abort_csv(path: str):
+    if os.path.exists(path + '.tmp'):
+        os.remove(path + '.tmp')
+
+
+def parquet_staging_dir(directory: str):
+    # Chunked runs write their part-<chunk number>.parquet files next to the directory, in <directory>.tmp, so the
+    # directory only ever holds the files of one complete run.
+    return os.path.normpath(directory) + '.tmp'
+
+
+def start_parquet(directory: str):
+    # A staging directory left by a run that was killed is removed first.
+    staging_dir = parquet_staging_dir(directory)
+    shutil.rmtree(staging_dir, ignore_errors=True)
+    return staging_dir
+
+
+def append_parquet(df: pd.DataFrame, staging_dir: str, chunk_number: int, written: list, writers: int = None):
+    # Every chunk adds a part-<chunk number>.parquet file to the partitions it has rows for, written collects them.
+    if pq is None:
+        return
+    written += write_parquet_files(df, staging_dir, f'part-{chunk_number}.parquet', writers)
+
+
+def finish_parquet(directory: str, written: list):
+    # The staging directory replaces the directory of the last run, which is moved aside and removed. Readers see
+    # the old or the new files, never a mix of both.
+    if pq is None:
+        print("pyarrow is not installed, the parquet output was skipped")
+        return
+    directory = os.path.normpath(directory)
+    old_dir = directory + '.old'
+    shutil.rmtree(old_dir, ignore_errors=True)
+    if os.path.exists(directory):
+        os.replace(directory, old_dir)
+    os.replace(parquet_staging_dir(directory), directory)
+    shutil.rmtree(old_dir, ignore_errors=True)
+    print(f'Wrote {len(written)} parquet files to {directory}')
+
+
+def abort_parquet(directory: str):
+    shutil.rmtree(parquet_staging_dir(directory), ignore_errors=True)
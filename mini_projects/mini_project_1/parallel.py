@@ -0,0 +1,86 @@
+import io
+import os
+import time
+import functools
+import numpy as np
+import pandas as pd
+from concurrent.futures import ProcessPoolExecutor
+from column_profile import merge_profiles
+import instrumentation
+
+
+def byte_ranges(file_path: str, partitions: int):
+    # Splits the rows after the header into byte ranges that start and end on a line break.
+    # Assumes no quoted field contains a line break, which holds for the bookings extract.
+    size = os.path.getsize(file_path)
+    with open(file_path, 'rb') as f:
+        header = f.readline()
+        first_row = f.tell()
+        boundaries = [first_row]
+        for partition in range(1, partitions):
+            f.seek(first_row + (size - first_row) * partition // partitions)
+            f.readline()
+            boundaries.append(min(f.tell(), size))
+        boundaries.append(size)
+    boundaries = sorted(set(boundaries))
+    return header, list(zip(boundaries[:-1], boundaries[1:]))
+
+
+def read_byte_range(file_path: str, header: bytes, start: int, end: int, read_csv):
+    # read_csv gets a file object holding the header and the rows of the range.
+    with open(file_path, 'rb') as f:
+        f.seek(start)
+        data = f.read(end - start)
+    return read_csv(io.BytesIO(header + data))
+
+
+def timed_partition(clean_partition, *args):
+    # CPU time, so workers waiting for a free core do not count as work. The instrumented calls the partition made
+    # in this worker are handed back with it, a worker process can clean several partitions.
+    start = time.process_time()
+    first_call = len(instrumentation.calls)
+    df, row_hashes, profile, raw_profile = clean_partition(*args)
+    return df, row_hashes, profile, raw_profile, time.process_time() - start, instrumentation.calls[first_call:]
+
+
+def clean_serially(file_path: str, header: bytes, ranges: list, clean_partition):
+    # The same partitions cleaned one after the other in this process, the baseline for the speedup. The results
+    # and the instrumented calls they made are thrown away.
+    first_call = len(instrumentation.calls)
+    start = time.perf_counter()
+    for a, b in ranges:
+        clean_partition(file_path, header, a, b)
+    seconds = time.perf_counter() - start
+    del instrumentation.calls[first_call:]
+    return seconds
+
+
+def clean_in_parallel(file_path: str, workers: int, clean_partition):
+    # clean_partition(file_path, header, start, end) -> (cleaned frame, row hashes, column profile of the cleaned
+    # rows, column profile of the rows as read) runs in the worker processes. Partitions are merged back in file
+    # order so the result has the same row order as the serial path, their column profiles are merged.
+    # PARALLEL_BASELINE=on first cleans the partitions serially to report the speedup of the pool.
+    header, ranges = byte_ranges(file_path, workers)
+    serial_seconds = None
+    if os.getenv("PARALLEL_BASELINE", "off") == "on":
+        serial_seconds = clean_serially(file_path, header, ranges, clean_partition)
+    start = time.perf_counter()
+    with ProcessPoolExecutor(max_workers=workers) as pool:
+        futures = [pool.submit(timed_partition, clean_partition, file_path, header, a, b) for a, b in ranges]
+        results = [future.result() for future in futures]
+    frames = [result[0] for result in results]
+    row_hashes = np.concatenate([result[1] for result in results])
+    hotel_bookings = pd.concat(frames, ignore_index=True)
+    profile = functools.reduce(merge_profiles, [result[2] for result in results], None)
+    raw_profile = functools.reduce(merge_profiles, [result[3] for result in results], None)
+    for result in results:
+        instrumentation.calls.extend(result[5])
+    wall_seconds = time.perf_counter() - start
+
+    # Worker CPU seconds per wall second, how busy the pool kept the cores. The speedup needs the serial baseline.
+    cpu_seconds = sum(result[4] for result in results)
+    print(f'Cleaned {len(ranges)} partitions with {workers} workers in {wall_seconds:.2f}s, '
+          f'{cpu_seconds:.2f}s of worker CPU time ({cpu_seconds / wall_seconds:.1f}x worker utilisation)')
+    if serial_seconds is not None:
+        print(f'Cleaning them serially took {serial_seconds:.2f}s, a {serial_seconds / wall_seconds:.1f}x speedup')
+    return hotel_bookings, row_hashes, profile, raw_profile
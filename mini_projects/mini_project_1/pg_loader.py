@@ -0,0 +1,206 @@
+import io
+import time
+import numpy as np
+import pandas as pd
+import psycopg2
+
+
+POSTGRES_TYPES = {
+    'int64': 'bigint',
+    'int32': 'integer',
+    'float64': 'double precision',
+    'bool': 'boolean',
+    'datetime64[ns]': 'timestamp',
+}
+COPY_BATCH_ROWS = 100_000
+FINGERPRINT_COLUMN = 'row_fingerprint'
+
+
+def quote_identifier(name: str):
+    return '"' + name.replace('"', '""') + '"'
+
+
+def postgres_type(dtype):
+    # Anything without a numeric/date mapping (object, category) is stored as text.
+    return POSTGRES_TYPES.get(str(dtype), 'text')
+
+
+def create_staging_table(cursor, table: str, dtypes: dict, with_fingerprints: bool = False):
+    staging_table = f'{table}_staging'
+    columns = [f'{quote_identifier(column)} {postgres_type(dtype)}' for column, dtype in dtypes.items()]
+    if with_fingerprints:
+        columns.append(f'{FINGERPRINT_COLUMN} bigint')
+    cursor.execute(f'DROP TABLE IF EXISTS {quote_identifier(staging_table)}')
+    cursor.execute(f'CREATE TABLE {quote_identifier(staging_table)} ({", ".join(columns)})')
+    if with_fingerprints:
+        # Left unnamed so postgres picks a name that does not clash with the index on the table being replaced.
+        cursor.execute(f'CREATE INDEX ON {quote_identifier(staging_table)} ({FINGERPRINT_COLUMN})')
+    return staging_table
+
+
+def copy_frame(cursor, table: str, df: pd.DataFrame, fingerprints: np.ndarray = None):
+    # Rows are streamed as CSV in batches so only one batch is ever serialized in memory.
+    columns = list(df.columns) + ([FINGERPRINT_COLUMN] if fingerprints is not None else [])
+    copy_sql = f'COPY {quote_identifier(table)} ({", ".join(quote_identifier(c) for c in columns)}) FROM STDIN WITH (FORMAT csv)'
+    for start in range(0, df.shape[0], COPY_BATCH_ROWS):
+        batch = df.iloc[start:start + COPY_BATCH_ROWS]
+        if fingerprints is not None:
+            batch = batch.assign(**{FINGERPRINT_COLUMN: fingerprints[start:start + COPY_BATCH_ROWS]})
+        buffer = io.StringIO()
+        batch.to_csv(buffer, index=False, header=False)
+        buffer.seek(0)
+        cursor.copy_expert(copy_sql, buffer)
+
+
+def copy_fingerprints(cursor, table: str, fingerprints: np.ndarray):
+    for start in range(0, len(fingerprints), COPY_BATCH_ROWS):
+        buffer = io.StringIO('\n'.join(map(str, fingerprints[start:start + COPY_BATCH_ROWS].tolist())) + '\n')
+        cursor.copy_expert(f'COPY {quote_identifier(table)} ({FINGERPRINT_COLUMN}) FROM STDIN', buffer)
+
+
+def swap_in_staging_table(cursor, staging_table: str, table: str):
+    # Runs in the same transaction as the commit so readers see either the old or the new table, never no table.
+    cursor.execute(f'DROP TABLE IF EXISTS {quote_identifier(table)}')
+    cursor.execute(f'ALTER TABLE {quote_identifier(staging_table)} RENAME TO {quote_identifier(table)}')
+
+
+def start_bulk_load(connection, table: str, dtypes: dict):
+    with connection.cursor() as cursor:
+        return create_staging_table(cursor, table, dtypes)
+
+
+def copy_chunk(connection, staging_table: str, df: pd.DataFrame):
+    with connection.cursor() as cursor:
+        copy_frame(cursor, staging_table, df)
+
+
+def copy_csv_chunk(connection, staging_table: str, text: str, header: bool):
+    # A chunk the csv output has already serialized (columns in staging table order), it is COPYed as it is
+    # instead of going through copy_frame again.
+    copy_sql = f'COPY {quote_identifier(staging_table)} FROM STDIN WITH (FORMAT csv, HEADER {str(header).lower()})'
+    with connection.cursor() as cursor:
+        cursor.copy_expert(copy_sql, io.StringIO(text))
+
+
+def finish_bulk_load(connection, staging_table: str, table: str):
+    with connection.cursor() as cursor:
+        swap_in_staging_table(cursor, staging_table, table)
+    connection.commit()
+
+
+def abort_bulk_load(connection, staging_table: str):
+    # After a failed COPY or swap: the rollback undoes the transaction the staging table was created in, the drop
+    # covers a staging table left by an earlier commit. The connection is closed, the caller re-raises the error.
+    try:
+        connection.rollback()
+        if staging_table is not None:
+            with connection.cursor() as cursor:
+                cursor.execute(f'DROP TABLE IF EXISTS {quote_identifier(staging_table)}')
+            connection.commit()
+    except psycopg2.Error as e:
+        print(f'Could not clean up {staging_table} after the failed load due to {e}')
+    finally:
+        connection.close()
+
+
+def bulk_load(connection, df: pd.DataFrame, table: str):
+    start = time.perf_counter()
+    staging_table = None
+    try:
+        staging_table = start_bulk_load(connection, table, df.dtypes.to_dict())
+        copy_chunk(connection, staging_table, df)
+        finish_bulk_load(connection, staging_table, table)
+    except Exception:
+        abort_bulk_load(connection, staging_table)
+        raise
+    report_load_rate(df.shape[0], time.perf_counter() - start)
+
+
+def row_fingerprints(df: pd.DataFrame):
+    # A stable 64 bit hash of every row stored as bigint. Repeated rows get their occurrence number mixed in
+    # so each copy keeps its own fingerprint and the load stays correct when duplicates are not dropped.
+    hashes = pd.util.hash_pandas_object(df, index=False).to_numpy()
+    occurrence = pd.Series(hashes).groupby(hashes).cumcount().to_numpy()
+    repeated = occurrence > 0
+    if repeated.any():
+        hashes = hashes.copy()
+        hashes[repeated] = pd.util.hash_pandas_object(
+            pd.DataFrame({'row': hashes[repeated], 'occurrence': occurrence[repeated]}), index=False).to_numpy()
+    return hashes.view('int64')
+
+
+def table_columns(cursor, table: str):
+    cursor.execute(
+        'SELECT column_name FROM information_schema.columns WHERE table_name = %s ORDER BY ordinal_position', (table,))
+    return [row[0] for row in cursor.fetchall()]
+
+
+def stored_fingerprints(cursor, table: str):
+    buffer = io.StringIO()
+    cursor.copy_expert(f'COPY (SELECT {FINGERPRINT_COLUMN} FROM {quote_identifier(table)}) TO STDOUT', buffer)
+    return np.array(buffer.getvalue().split(), dtype='int64')
+
+
+def incremental_load(connection, df: pd.DataFrame, table: str):
+    # Only rows whose fingerprint is not stored yet are inserted and only stored fingerprints that are no longer
+    # in the data are deleted. Both happen in one transaction. Without stored fingerprints (first run or a
+    # changed set of columns) it falls back to a full load that stores them.
+    start = time.perf_counter()
+    fingerprints = row_fingerprints(df)
+    try:
+        new_rows, stale = load_changed_rows(connection, df, table, fingerprints)
+    except Exception:
+        abort_bulk_load(connection, f'{table}_staging')
+        raise
+    if new_rows is None:
+        report_load_rate(df.shape[0], time.perf_counter() - start)
+        return
+    print(f'Inserted {int(new_rows.sum())} rows and deleted {len(stale)} rows, '
+          f'{df.shape[0] - int(new_rows.sum())} rows were already loaded')
+    report_load_rate(int(new_rows.sum()) + len(stale), time.perf_counter() - start)
+
+
+def load_changed_rows(connection, df: pd.DataFrame, table: str, fingerprints: np.ndarray):
+    # Returns the mask of inserted rows and the deleted fingerprints, None for both after a full load.
+    with connection.cursor() as cursor:
+        if table_columns(cursor, table) != list(df.columns) + [FINGERPRINT_COLUMN]:
+            print(f'{table} has no matching fingerprints yet, doing a full load')
+            staging_table = create_staging_table(cursor, table, df.dtypes.to_dict(), with_fingerprints=True)
+            copy_frame(cursor, staging_table, df, fingerprints)
+            swap_in_staging_table(cursor, staging_table, table)
+            connection.commit()
+            return None, None
+
+        known = stored_fingerprints(cursor, table)
+        new_rows = ~np.isin(fingerprints, known)
+        stale = known[~np.isin(known, fingerprints)]
+
+        cursor.execute(f'CREATE TEMPORARY TABLE stale_fingerprints ({FINGERPRINT_COLUMN} bigint) ON COMMIT DROP')
+        copy_fingerprints(cursor, 'stale_fingerprints', stale)
+        cursor.execute(f'DELETE FROM {quote_identifier(table)} t USING stale_fingerprints s '
+                       f'WHERE t.{FINGERPRINT_COLUMN} = s.{FINGERPRINT_COLUMN}')
+        copy_frame(cursor, table, df[new_rows], fingerprints[new_rows])
+    connection.commit()
+    return new_rows, stale
+
+
+def bulk_load_csv(connection, csv_path: str, table: str, dtypes: dict):
+    # Loads a csv file written from the frame (header row, columns in dtypes order) so the rows are not
+    # serialized a second time for COPY. Empty fields are NULL like in copy_frame.
+    start = time.perf_counter()
+    staging_table = None
+    try:
+        staging_table = start_bulk_load(connection, table, dtypes)
+        copy_sql = f'COPY {quote_identifier(staging_table)} FROM STDIN WITH (FORMAT csv, HEADER true)'
+        with connection.cursor() as cursor, open(csv_path) as f:
+            cursor.copy_expert(copy_sql, f)
+            rows = cursor.rowcount
+        finish_bulk_load(connection, staging_table, table)
+    except Exception:
+        abort_bulk_load(connection, staging_table)
+        raise
+    report_load_rate(rows, time.perf_counter() - start)
+
+
+def report_load_rate(rows: int, seconds: float):
+    print(f'Loaded {rows} rows in {seconds:.2f}s ({rows / max(seconds, 1e-9):,.0f} rows/s)')
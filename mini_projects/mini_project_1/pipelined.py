@@ -0,0 +1,98 @@
+import time
+import queue
+import itertools
+import threading
+
+
+# Marks the end of the chunks on a queue.
+DONE = object()
+
+
+def put(to_queue: queue.Queue, item, stop: threading.Event):
+    # Blocks while the queue is full, that is the backpressure. Gives up once another stage failed so a full
+    # queue nobody reads any more cannot hang the run.
+    while not stop.is_set():
+        try:
+            to_queue.put(item, timeout=0.1)
+            return True
+        except queue.Full:
+            pass
+    return False
+
+
+def get(from_queue: queue.Queue, stop: threading.Event):
+    while not stop.is_set():
+        try:
+            return from_queue.get(timeout=0.1)
+        except queue.Empty:
+            pass
+    return DONE
+
+
+def run_pipelined(chunks, clean_chunk, writers: dict, queue_size: int = 2):
+    # chunks is an iterator of frames, clean_chunk(chunk_number, chunk) returns the cleaned chunk and every
+    # writer(chunk_number, chunk) in writers gets each cleaned chunk. Each runs in its own thread, joined by queues
+    # of queue_size chunks, so the next chunk is read while one is cleaned and the one before it is written.
+    # pandas parsing and the database round trips release the GIL, that is where the overlap comes from.
+    # Returns the seconds every stage spent working on its chunks.
+    stop = threading.Event()
+    errors = []
+    stage_seconds = {name: 0.0 for name in ['read', 'clean'] + list(writers)}
+    clean_queue = queue.Queue(maxsize=queue_size)
+    writer_queues = {name: queue.Queue(maxsize=queue_size) for name in writers}
+
+    def run_stage(name, work):
+        try:
+            work()
+        except BaseException as e:
+            errors.append((name, e))
+            stop.set()
+
+    def read():
+        iterator = iter(chunks)
+        for chunk_number in itertools.count():
+            start = time.perf_counter()
+            chunk = next(iterator, DONE)
+            stage_seconds['read'] += time.perf_counter() - start
+            if chunk is DONE or not put(clean_queue, (chunk_number, chunk), stop):
+                break
+        put(clean_queue, DONE, stop)
+
+    def clean():
+        while (item := get(clean_queue, stop)) is not DONE:
+            start = time.perf_counter()
+            chunk_number, chunk = item
+            chunk = clean_chunk(chunk_number, chunk)
+            stage_seconds['clean'] += time.perf_counter() - start
+            # Every writer gets the same frame, writers must not change it.
+            for writer_queue in writer_queues.values():
+                put(writer_queue, (chunk_number, chunk), stop)
+        for writer_queue in writer_queues.values():
+            put(writer_queue, DONE, stop)
+
+    def write(name):
+        while (item := get(writer_queues[name], stop)) is not DONE:
+            start = time.perf_counter()
+            writers[name](*item)
+            stage_seconds[name] += time.perf_counter() - start
+
+    threads = [threading.Thread(target=run_stage, args=('read', read)),
+               threading.Thread(target=run_stage, args=('clean', clean))]
+    threads += [threading.Thread(target=run_stage, args=(name, lambda name=name: write(name))) for name in writers]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+    if errors:
+        name, error = errors[0]
+        raise RuntimeError(f'The {name} stage of the pipeline failed') from error
+    return stage_seconds
+
+
+def report_overlap(stage_seconds: dict, wall_seconds: float):
+    # Busy time includes waiting for the GIL while another stage runs python code, so with few cores it
+    # overstates what the stages take one after the other. A CHUNK_SIZE run gives the sequential wall time.
+    busy_seconds = sum(stage_seconds.values())
+    print(', '.join(f'{name} {seconds:.2f}s' for name, seconds in stage_seconds.items()))
+    print(f'Pipelined run took {wall_seconds:.2f}s, the stages were busy for {busy_seconds:.2f}s between them '
+          f'({busy_seconds / wall_seconds:.2f}x overlap)')
@@ -0,0 +1,59 @@
+import functools
+import numpy as np
+import pandas as pd
+import iso3166
+from business_rules import BUSINESS_RULES
+
+
+# Dimension columns whose values are mapped onto their reference values by handle_business_logic_issues.
+REFERENCE_COLUMNS = ['country', 'market_segment', 'distribution_channel']
+
+# Spellings iso3166 does not know. TMP is the old code for East Timor, it shows up in the data and stays as it is.
+COUNTRY_ALIASES = {'UK': 'GBR', 'TMP': 'TMP'}
+
+
+def normalize_key(value):
+    # Lookups ignore case and repeated whitespace, eg: ' online  ta' finds 'Online TA'.
+    return ' '.join(str(value).split()).upper()
+
+
+@functools.lru_cache(maxsize=None)
+def country_lookup():
+    # alpha-2, alpha-3, numeric code and name of every country, all pointing at the alpha-3 code.
+    lookup = {}
+    for country in iso3166.countries:
+        for key in [country.alpha2, country.alpha3, country.numeric, country.name, country.apolitical_name]:
+            lookup[normalize_key(key)] = country.alpha3
+    lookup.update({normalize_key(alias): code for alias, code in COUNTRY_ALIASES.items()})
+    return lookup
+
+
+@functools.lru_cache(maxsize=None)
+def reference_lookup(column: str):
+    # Built once per process. Columns other than country map onto the allowed values of their business rule.
+    if column == 'country':
+        return country_lookup()
+    rule = next(rule for rule in BUSINESS_RULES if rule['column'] == column)
+    return {normalize_key(value): value for value in rule['allowed']}
+
+
+def normalize_column(column: pd.Series, lookup: dict):
+    # Works on the categories, so the lookup runs once per distinct value and the rows only get new codes.
+    # Returns the normalized column, a mask of the rows whose value changed and {value: rows} for values
+    # the lookup does not know, those are kept as they are.
+    values = column if isinstance(column.dtype, pd.CategoricalDtype) else column.astype('category')
+    categories = values.cat.categories
+    keys = [normalize_key(value) for value in categories]
+    mapped = pd.Index([lookup.get(key, value) for key, value in zip(keys, categories)])
+
+    # Several spellings can map onto one value, eg: CN and CHN, categories have to stay unique.
+    new_codes, new_categories = pd.factorize(mapped)
+    codes = values.cat.codes.to_numpy()
+    # -1 marks a missing value, the extra entry at the end keeps it -1 and unchanged.
+    normalized = pd.Categorical.from_codes(np.append(new_codes, -1)[codes], categories=new_categories)
+    changed_categories = np.append((mapped != categories), False)
+
+    rows_per_category = np.bincount(codes[codes >= 0], minlength=len(categories))
+    unmapped = {value: int(rows_per_category[position]) for position, (key, value) in enumerate(zip(keys, categories))
+                if key not in lookup and rows_per_category[position] > 0}
+    return pd.Series(normalized, index=column.index, name=column.name), changed_categories[codes], unmapped
@@ -0,0 +1,162 @@
+import io
+import os
+import sys
+import json
+import time
+import hashlib
+import inspect
+import itertools
+import pandas as pd
+import dates
+from dates import DATE_FORMATS, parse_dates
+
+try:
+    import pyarrow  # noqa: F401
+    CSV_ENGINE = 'pyarrow'
+except ImportError:
+    CSV_ENGINE = 'c'
+
+
+# Low cardinality text columns. Stored as category they hold one small integer code per row instead of a python string.
+CATEGORY_COLUMNS = [
+    'hotel', 'arrival_date_month', 'meal', 'country', 'market_segment', 'distribution_channel', 'reserved_room_type',
+    'assigned_room_type', 'deposit_type', 'customer_type', 'reservation_status',
+]
+
+# Integer columns with missing values in the extract. They are read as float64 and become int64 once
+# handle_missing_values has filled or dropped the missing values.
+NULLABLE_INT_COLUMNS = ['children', 'agent', 'company']
+
+EXPECTED_DATATYPES = {
+    'hotel': 'category',
+    'is_canceled': 'int64',
+    'lead_time': 'float64',
+    'arrival_date_year': 'int64',
+    'arrival_date_month': 'category',
+    'arrival_date_week_number': 'int64',
+    'arrival_date_day_of_month': 'int64',
+    'arrival_date': 'datetime64[ns]',
+    'stays_in_weekend_nights': 'int64',
+    'stays_in_week_nights': 'int64',
+    'days_in_waiting_list': 'float64',
+    'adults': 'int64',
+    'children': 'int64',
+    'babies': 'int64',
+    'meal': 'category',
+    'country': 'category',
+    'market_segment': 'category',
+    'distribution_channel': 'category',
+    'is_repeated_guest': 'int64',
+    'previous_cancellations': 'int64',
+    'previous_bookings_not_canceled': 'int64',
+    'reserved_room_type': 'category',
+    'assigned_room_type': 'category',
+    'booking_changes': 'int64',
+    'deposit_type': 'category',
+    'agent': 'int64',
+    'company': 'int64',
+    'days_in_waiting_list,': 'float64',
+    'customer_type': 'category',
+    'adr': 'float64',
+    'required_car_parking_spaces': 'int64',
+    'total_of_special_requests': 'int64',
+    'reservation_status': 'category',
+    'reservation_status_date': 'datetime64[ns]'
+}
+
+# Column order of the Kaggle hotel_bookings.csv extract.
+CSV_COLUMNS = [
+    'hotel', 'is_canceled', 'lead_time', 'arrival_date_year', 'arrival_date_month', 'arrival_date_week_number',
+    'arrival_date_day_of_month', 'stays_in_weekend_nights', 'stays_in_week_nights', 'adults', 'children', 'babies',
+    'meal', 'country', 'market_segment', 'distribution_channel', 'is_repeated_guest', 'previous_cancellations',
+    'previous_bookings_not_canceled', 'reserved_room_type', 'assigned_room_type', 'booking_changes', 'deposit_type',
+    'agent', 'company', 'days_in_waiting_list', 'customer_type', 'adr', 'required_car_parking_spaces',
+    'total_of_special_requests', 'reservation_status', 'reservation_status_date',
+]
+
+# Columns built by the cleaning stages, they are not in the CSV file.
+DERIVED_COLUMNS = ['days_in_waiting_list,', 'arrival_date']
+
+# Date columns are read as category and parsed once per distinct value by read_bookings.
+READ_DATATYPES = {
+    column: 'float64' if column in NULLABLE_INT_COLUMNS else 'category' if column in DATE_FORMATS else dtype
+    for column, dtype in EXPECTED_DATATYPES.items()
+    if column not in DERIVED_COLUMNS
+}
+
+# Every integer column read as float64, for files with missing values outside NULLABLE_INT_COLUMNS. Those columns
+# become int64 once handle_missing_values has dropped the rows with missing values, like the nullable ones.
+FALLBACK_READ_DATATYPES = {column: 'float64' if dtype == 'int64' else dtype for column, dtype in READ_DATATYPES.items()}
+
+
+def release_arrow_memory():
+    # pyarrow keeps freed buffers in its memory pool for reuse, after a read with it that is most of the file.
+    if CSV_ENGINE == 'pyarrow':
+        pyarrow.default_memory_pool().release_unused()
+
+
+def narrow_int_columns(df: pd.DataFrame):
+    # Integer columns read with FALLBACK_READ_DATATYPES go back to int64 where they have no missing values.
+    for column, dtype in READ_DATATYPES.items():
+        if dtype == 'int64' and df[column].dtype != dtype and not df[column].hasnans:
+            df[column] = df[column].astype(dtype)
+    return df
+
+
+def read_bookings(file_path, chunksize: int = None):
+    # file_path can also be a file object, the parallel mode hands in byte ranges of the file.
+    if chunksize:
+        # The pyarrow engine cannot stream chunks. A chunk that fails cannot be read again, so chunks are read with
+        # the fallback types and narrowed.
+        return (parse_dates(narrow_int_columns(chunk))
+                for chunk in pd.read_csv(file_path, dtype=FALLBACK_READ_DATATYPES, chunksize=chunksize))
+    try:
+        return parse_dates(pd.read_csv(file_path, dtype=READ_DATATYPES, engine=CSV_ENGINE))
+    except ValueError as e:
+        # Missing values in an integer column (IntCastingNaNError), handle_missing_values drops those rows.
+        print(f"Reading the integer columns as float64 due to {e}")
+        if hasattr(file_path, 'seek'):
+            file_path.seek(0)
+        df = pd.read_csv(file_path, dtype=FALLBACK_READ_DATATYPES, engine=CSV_ENGINE)
+        return parse_dates(narrow_int_columns(df))
+
+
+def schema_version():
+    # Changes with the dtypes, the date formats or the date parsing code, a cached frame read with another
+    # schema is not reused (csv_cache.py).
+    digest = hashlib.sha256(json.dumps([READ_DATATYPES, FALLBACK_READ_DATATYPES, DATE_FORMATS, CSV_ENGINE], sort_keys=True).encode())
+    for function in (read_bookings, narrow_int_columns, dates.parse_dates, dates.parse_date_column):
+        digest.update(inspect.getsource(function).encode())
+    return digest.hexdigest()
+
+
+def estimate_frame_bytes(file_path: str, sample_rows: int = 10_000):
+    # Memory of the parsed file, extrapolated from the first sample_rows rows by their share of the file size.
+    # Returns the estimate for the whole file and per row.
+    with open(file_path, 'rb') as f:
+        sample = b''.join(itertools.islice(f, sample_rows + 1))
+    frame = read_bookings(io.BytesIO(sample))
+    row_bytes = frame.memory_usage(index=True, deep=True).sum() / max(frame.shape[0], 1)
+    rows = frame.shape[0] * os.path.getsize(file_path) / len(sample)
+    return row_bytes * rows, row_bytes
+
+
+def ingest_report(file_path: str):
+    start = time.perf_counter()
+    untyped = pd.read_csv(file_path)
+    untyped_seconds = time.perf_counter() - start
+    untyped_memory = untyped.memory_usage(deep=True).sum()
+    del untyped
+
+    start = time.perf_counter()
+    typed = read_bookings(file_path)
+    typed_seconds = time.perf_counter() - start
+    typed_memory = typed.memory_usage(deep=True).sum()
+
+    print(f'Untyped read: {untyped_seconds:.2f}s, {untyped_memory / 1024 ** 2:.1f} MiB')
+    print(f'Typed read ({CSV_ENGINE} engine): {typed_seconds:.2f}s, {typed_memory / 1024 ** 2:.1f} MiB')
+    print(f'Memory is {untyped_memory / typed_memory:.1f}x smaller and parsing {untyped_seconds / typed_seconds:.1f}x faster')
+
+
+if __name__ == "__main__":
+    ingest_report(sys.argv[1] if len(sys.argv) > 1 else "./hotel_bookings.csv")
@@ -0,0 +1,66 @@
+import os
+import csv
+import time
+import bisect
+import functools
+
+# Exchange rates read once from exchange_rates.csv (currency_code,rate_to_usd,last_updated) instead of on every
+# conversion. Every currency keeps its last_updated dates sorted next to their rates, the latest rate is one
+# dict lookup and the rate on a date is a binary search over that currency's dates.
+
+# How often, at most, the file is checked for changes.
+RELOAD_CHECK_SECONDS = 1.0
+
+
+class ExchangeRates:
+    def __init__(self, path):
+        self.path = path
+        self.rates = {}
+        self.mtime_ns = None
+        self.checked_at = time.monotonic()
+        self.load()
+
+    def load(self):
+        mtime_ns = os.stat(self.path).st_mtime_ns
+        rows = {}
+        with open(self.path, newline='') as f:
+            for row in csv.DictReader(f):
+                rows.setdefault(row['currency_code'], []).append((row['last_updated'], float(row['rate_to_usd'])))
+        # Dates are YYYY-MM-DD so sorting the text sorts them by date.
+        self.rates = {}
+        for currency, currency_rows in rows.items():
+            currency_rows.sort()
+            self.rates[currency] = ([date for date, _ in currency_rows], [rate for _, rate in currency_rows])
+        self.mtime_ns = mtime_ns
+
+    def reload_if_changed(self):
+        now = time.monotonic()
+        if now - self.checked_at < RELOAD_CHECK_SECONDS:
+            return
+        self.checked_at = now
+        if os.stat(self.path).st_mtime_ns != self.mtime_ns:
+            self.load()
+
+    def currencies(self):
+        self.reload_if_changed()
+        return sorted(self.rates)
+
+    def rate(self, currency, on=None):
+        # Rate to USD that was in effect on the date `on` (YYYY-MM-DD or a date), the latest one without a date.
+        # Dates before the first last_updated of the currency get its earliest rate, like before rates had dates.
+        self.reload_if_changed()
+        if currency not in self.rates:
+            raise ValueError(f"No exchange rate for {currency}")
+        dates, rates = self.rates[currency]
+        if on is None:
+            return rates[-1]
+        if not isinstance(on, str):
+            on = on.isoformat()[:10]
+        position = bisect.bisect_right(dates, on)
+        return rates[max(position - 1, 0)]
+
+
+@functools.lru_cache(maxsize=None)
+def load_exchange_rates(path='./exchange_rates.csv'):
+    # One ExchangeRates per file for the whole run.
+    return ExchangeRates(path)
@@ -0,0 +1,100 @@
+import json
+
+# Reads orders one at a time so a multi GB orders.json never has to be in memory at once.
+# Works on a top level JSON array ([{...}, {...}]) or on NDJSON (one JSON object per line).
+
+READ_SIZE = 64 * 1024
+decoder = json.JSONDecoder()
+
+
+def skip_whitespace(buffer, position):
+    while position < len(buffer) and buffer[position] in ' \t\r\n':
+        position += 1
+    return position
+
+
+def iter_json_array(f, read_size=READ_SIZE):
+    # raw_decode parses one value starting at a position and says where it ended, so only the value being
+    # parsed and the rest of the last read are kept in the buffer.
+    buffer = ''
+    position = 0
+    eof = False
+
+    def read_more():
+        # Drops what was already parsed. Reading at least as much as is buffered keeps a value bigger than
+        # read_size from being parsed again for every read_size bytes.
+        nonlocal buffer, position, eof
+        buffer = buffer[position:]
+        position = 0
+        more = f.read(max(read_size, len(buffer)))
+        eof = more == ''
+        buffer += more
+
+    def next_character():
+        # The next character that is not whitespace, reading more when the buffer runs out. '' at the end of the file.
+        nonlocal position
+        while True:
+            position = skip_whitespace(buffer, position)
+            if position < len(buffer) or eof:
+                return buffer[position:position + 1]
+            read_more()
+
+    def next_value():
+        nonlocal position
+        while True:
+            if next_character() == '':
+                raise ValueError("The JSON array is not closed")
+            try:
+                value, end = decoder.raw_decode(buffer, position)
+            except json.JSONDecodeError:
+                if eof:
+                    raise
+                read_more()
+                continue
+            # A number at the end of the buffer, or right before a character that is not whitespace or a
+            # delimiter (2. of 2.5), could continue in the next read.
+            if eof or (end < len(buffer) and buffer[end] in ' \t\r\n,]'):
+                position = end
+                return value
+            read_more()
+
+    if next_character() != '[':
+        raise ValueError("Expected a JSON array")
+    position += 1
+    if next_character() == ']':
+        position += 1
+    else:
+        while True:
+            yield next_value()
+            character = next_character()
+            position += 1
+            if character == ']':
+                break
+            if character == '':
+                raise ValueError("The JSON array is not closed")
+            if character != ',':
+                raise ValueError(f"Expected , or ] after a value of the JSON array, got {character!r}")
+    if next_character() != '':
+        raise ValueError("Unexpected data after the JSON array")
+
+
+def iter_ndjson(f):
+    for line in f:
+        line = line.strip()
+        if line:
+            yield json.loads(line)
+
+
+def iter_orders(path):
+    # Looks at the first character that is not whitespace to tell an array from NDJSON.
+    with open(path) as f:
+        first = ''
+        while first == '' or first.isspace():
+            first = f.read(1)
+            if first == '':
+                return
+        f.seek(0)
+        if first == '[':
+            yield from iter_json_array(f)
+        else:
+            yield from iter_ndjson(f)
@@ -1,6 +1,8 @@
 import json
 import pandas as pd
 import os
+from json_stream import iter_orders
+from exchange_rates import load_exchange_rates
 
 # ==========================================
 # PART 0: SETUP (Generates Dummy Data Files)
@@ -62,9 +64,8 @@ create_dummy_files()
 # ==========================================
 print("\n--- Task 1: Parsing JSON ---")
 
-# Load the file
-with open('./orders.json', 'r') as f:
-    raw_data = json.load(f)
+# Load the file, one order at a time (json_stream.py) instead of the whole file with json.load
+raw_data = iter_orders('./orders.json')
 
 # Challenge: The data is nested. We want a "flat" list of orders.
 # We want to extract: Order ID, Customer Name, and the Sum of all item prices.
@@ -107,35 +108,38 @@ gbp_rate = df_rates.loc[df_rates['currency_code'] == 'GBP', 'rate_to_usd'].value
 
 print(f"\nExtracted GBP Rate: {gbp_rate}")
 
+# The same rates loaded once into exchange_rates.py, every currency and date can be looked up without pandas
+exchange_rates = load_exchange_rates('./exchange_rates.csv')
+print(f"Currencies in the rate table: {exchange_rates.currencies()}")
+
 
 # ==========================================
 # TASK 3: TRANSFORMATION FUNCTION
 # ==========================================
 print("\n--- Task 3: Data Transformation ---")
 
-def transform_currency(order_list, conversion_rate):
+def transform_currency(order_list, exchange_rates, currency='GBP'):
     """
-    Takes a list of order dictionaries and a conversion rate.
-    Returns a new list with an added 'total_usd' field.
+    Takes a list of order dictionaries and the exchange rates.
+    Returns a DataFrame of the orders with an added 'total_usd' column.
     """
-    transformed_data = []
-    
-    for order in order_list:
-        # Create a copy so we don't mess up the original list
-        new_order = order.copy()
-        
-        # Apply transformation: GBP * Rate = USD
-        # round(value, 2) keeps it to 2 decimal places
-        usd_amount = round(new_order['total_gbp'] * conversion_rate, 2)
-        
-        # Add new field
-        new_order['total_usd'] = usd_amount
-        transformed_data.append(new_order)
-        
+    # The orders become columns once, no copy of every order dictionary
+    transformed_data = pd.DataFrame(order_list)
+
+    # One rate per distinct order date (the latest rate for orders without one), then one multiply for all orders
+    # GBP * Rate = USD, round(2) keeps it to 2 decimal places
+    if 'order_date' in transformed_data:
+        order_dates = transformed_data['order_date']
+        rates = order_dates.map({date: exchange_rates.rate(currency, date) for date in order_dates.dropna().unique()})
+        rates = rates.fillna(exchange_rates.rate(currency))
+    else:
+        rates = exchange_rates.rate(currency)
+    transformed_data['total_usd'] = (transformed_data['total_gbp'] * rates).round(2)
+
     return transformed_data
 
 # Run the transformation
-final_dataset = transform_currency(parsed_orders, gbp_rate)
+final_dataset = transform_currency(parsed_orders, exchange_rates)
 
 # Create a final Pandas DataFrame to look at the results nicely
 df_final = pd.DataFrame(final_dataset)
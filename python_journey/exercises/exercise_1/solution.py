@@ -1,5 +1,10 @@
-import json
+import os
+import glob
+import numpy as np
 import pandas as pd
+from json_stream import iter_orders
+from exchange_rates import load_exchange_rates
+from concurrent.futures import ProcessPoolExecutor
 
 # dumps is into json.
 # loads is from json
@@ -10,19 +15,16 @@ def calculate_total_gbp(items):
         total += item["price_gbp"] 
     return total
 
-def convert_gbp_usd(gbp):
-    exchange_rates = pd.read_csv('./exchange_rates.csv')
-    gbp_to_usd_rate = exchange_rates[exchange_rates['currency_code'] == 'GBP']['rate_to_usd'].iloc[0]
-    return gbp * float(gbp_to_usd_rate)
+def convert_gbp_usd(gbp, on=None):
+    # The rates file is read once and reread only when it changes, on picks the rate in effect on that date.
+    return gbp * load_exchange_rates('./exchange_rates.csv').rate('GBP', on)
 
-def main():
+def dict_report(orders):
     customer_totals = {}
-    with open("./orders.json") as f:
-        orders = json.loads(f.read())
     for order in orders:
         # if order['status'] == 'completed':
         total_order_price_gbp = calculate_total_gbp(order["items"])
-        total_order_price_usd = convert_gbp_usd(total_order_price_gbp)
+        total_order_price_usd = convert_gbp_usd(total_order_price_gbp, order.get('order_date'))
         if order['customer']['id'] in customer_totals:
             customer_totals[order['customer']['id']]['orders'].append(
                 {
@@ -55,11 +57,101 @@ def main():
             output_dict['total_gbp'].append(order['total_gbp'])
             output_dict['total_usd'].append(order['total_usd'])
     
-    output_df = pd.DataFrame(output_dict)
+    return pd.DataFrame(output_dict)
+
+
+def flatten_orders(orders):
+    # One pass over the orders into flat lists. Items are exploded into item_orders (position of their order)
+    # and prices, so totals can be summed without a loop per order.
+    columns = {'order_id': [], 'customer_id': [], 'customer_name': [], 'order_date': [], 'item_order': [], 'price_gbp': []}
+    for position, order in enumerate(orders):
+        columns['order_id'].append(order['order_id'])
+        columns['customer_id'].append(order['customer']['id'])
+        columns['customer_name'].append(order['customer']['name'])
+        columns['order_date'].append(order.get('order_date'))
+        items = order['items']
+        columns['item_order'].extend([position] * len(items))
+        columns['price_gbp'].extend(item['price_gbp'] for item in items)
+    return columns
+
+
+def order_rates(order_dates, currency='GBP'):
+    # One rate lookup per distinct order date, orders without a date get the latest rate.
+    codes, dates = pd.factorize(pd.Series(order_dates, dtype=object), use_na_sentinel=False)
+    exchange_rates = load_exchange_rates('./exchange_rates.csv')
+    rates = np.array([exchange_rates.rate(currency, None if pd.isna(date) else date) for date in dates])
+    return rates[codes]
+
+
+def customer_orders(orders):
+    # Same rows as dict_report plus customer_id. Totals are a bincount (summed in item order, like
+    # calculate_total_gbp) and the conversion is one multiply. Customers are numbered in order of first appearance
+    # and a stable sort on that number gives the customer grouping of dict_report.
+    columns = flatten_orders(orders)
+    order_count = len(columns['order_id'])
+    prices = np.asarray(columns['price_gbp'])
+    totals_gbp = np.bincount(np.asarray(columns['item_order'], dtype=np.int64), weights=prices, minlength=order_count)
+    if len(prices) == 0 or prices.dtype.kind in 'iu':
+        # Integer prices sum to integers in calculate_total_gbp.
+        totals_gbp = totals_gbp.astype(np.int64)
+    totals_usd = totals_gbp * order_rates(columns['order_date'])
+
+    customer_codes, _ = pd.factorize(pd.Series(columns['customer_id'], dtype=object))
+    _, first_orders = np.unique(customer_codes, return_index=True)
+    names = np.asarray(columns['customer_name'], dtype=object)[first_orders][customer_codes]
+    grouped = np.argsort(customer_codes, kind='stable')
+    return pd.DataFrame({
+        'customer_id': np.asarray(columns['customer_id'], dtype=object)[grouped],
+        'order_id': np.asarray(columns['order_id'], dtype=object)[grouped],
+        'customer_name': names[grouped],
+        'total_gbp': totals_gbp[grouped],
+        'total_usd': totals_usd[grouped],
+    })
+
+
+def columnar_report(orders):
+    return customer_orders(orders).drop(columns='customer_id')
+
+
+def shard_partial(path):
+    # Runs in a worker process, the orders of one shard grouped by customer.
+    return customer_orders(iter_orders(path))
+
+
+def merge_partials(partials):
+    # partials come in shard order. Regrouping them by customer in order of first appearance, with a stable sort,
+    # gives the report of all the shards read one after the other, whichever worker finished first.
+    partials = [partial for partial in partials if not partial.empty]
+    if not partials:
+        return pd.DataFrame(columns=['order_id', 'customer_name', 'total_gbp', 'total_usd'])
+    combined = pd.concat(partials, ignore_index=True)
+    customer_codes, _ = pd.factorize(combined['customer_id'])
+    _, first_orders = np.unique(customer_codes, return_index=True)
+    combined['customer_name'] = combined['customer_name'].to_numpy()[first_orders][customer_codes]
+    return combined.iloc[np.argsort(customer_codes, kind='stable')].drop(columns='customer_id')
+
+
+def sharded_report(paths, workers):
+    # Shards are parsed and grouped by WORKERS processes, results are collected in shard order.
+    with ProcessPoolExecutor(max_workers=workers) as pool:
+        return merge_partials(list(pool.map(shard_partial, paths)))
+
+
+def main():
+    # ORDERS_SHARDS=./orders-*.json reads every matching shard in name order instead of orders.json, spread over
+    # WORKERS processes (one per core by default). ORDERS_ENGINE=dict runs the original order by order version.
+    shards = os.getenv("ORDERS_SHARDS", "")
+    if shards:
+        output_df = sharded_report(sorted(glob.glob(shards)), int(os.getenv("WORKERS", "0")) or os.cpu_count())
+    else:
+        # One order at a time, works for a JSON array or NDJSON.
+        orders = iter_orders("./orders.json")
+        if os.getenv("ORDERS_ENGINE", "columnar") == "dict":
+            output_df = dict_report(orders)
+        else:
+            output_df = columnar_report(orders)
     output_df.to_csv('generated_final_report.csv',index=False)
-        
 
-    
 
 if __name__ == "__main__":
     main()
\ No newline at end of file
@@ -0,0 +1,273 @@
+import os
+import re
+import json
+import time
+import argparse
+import datetime
+import statistics
+import psycopg2
+from dotenv import load_dotenv
+
+EXERCISE_DIR = os.path.dirname(os.path.abspath(__file__))
+
+# Same tables as solution.sql. The foreign keys are added after the bulk insert so they are checked once for the
+# whole table instead of row by row.
+CREATE_TABLES = '''
+drop table if exists orders, products, customers;
+
+create table customers (
+    customer_id serial primary key,
+    name varchar not null,
+    email varchar not null
+);
+
+create table products (
+    product_id serial primary key,
+    product_name varchar not null,
+    price decimal(6, 2) not null
+);
+
+create table orders (
+    order_id serial primary key,
+    customer_id bigint,
+    product_id bigint,
+    quantity int not null,
+    order_date date not null
+);
+'''
+
+# The three products of the exercise come first so the queries still find a Laptop, the rest are made up.
+# setseed makes every run generate the same rows.
+GENERATE_DATA = '''
+select setseed(%(seed)s);
+
+insert into products (product_name, price) values ('Laptop', 1200), ('Headphones', 150), ('Mouse', 40);
+insert into products (product_name, price)
+select 'Product ' || n, round((5 + random() * 2000)::numeric, 2)
+from generate_series(4, %(products)s) as n;
+
+insert into customers (name, email)
+select 'Customer ' || n, 'customer' || n || '@example.com'
+from generate_series(1, %(customers)s) as n;
+
+insert into orders (customer_id, product_id, quantity, order_date)
+select 1 + floor(random() * %(customers)s)::bigint,
+       1 + floor(random() * %(products)s)::bigint,
+       1 + floor(random() * 5)::int,
+       date '2024-01-01' + floor(random() * 366)::int
+from generate_series(1, %(orders)s);
+
+alter table orders add foreign key (customer_id) references customers (customer_id);
+alter table orders add foreign key (product_id) references products (product_id);
+'''
+
+# Foreign key columns of the exercise tables that no index starts with. Postgres indexes the referenced primary
+# key but not the referencing column, so deleting a customer or a product scans the whole orders table.
+UNINDEXED_FOREIGN_KEYS = '''
+select c.conrelid::regclass::text, a.attname
+from pg_constraint c
+join pg_attribute a on a.attrelid = c.conrelid and a.attnum = c.conkey[1]
+where c.contype = 'f'
+  and c.conrelid in ('orders'::regclass, 'products'::regclass, 'customers'::regclass)
+  and not exists (select 1 from pg_index i where i.indrelid = c.conrelid and i.indkey[0] = c.conkey[1])
+order by 1, 2
+'''
+
+# Covering indexes for queries that only read a few columns of orders. Query 3 filters on product_id and reads
+# customer_id, with both in the index it becomes an index only scan.
+COVERING_INDEXES = [
+    ('orders_product_id_customer_id_idx', 'create index orders_product_id_customer_id_idx '
+                                          'on orders (product_id) include (customer_id)'),
+]
+
+# Deletes a customer without orders inside a transaction that is rolled back. The foreign key check on orders
+# shows up as a trigger in the plan, that is the cost an index on orders.customer_id removes.
+FOREIGN_KEY_CHECK = '''
+with new_customer as (
+    insert into customers (name, email) values ('Scale Test', 'scale@example.com') returning customer_id
+)
+select customer_id from new_customer
+'''
+
+
+def connect(database):
+    # Same credentials as postgres_local/compose.yaml.
+    return psycopg2.connect(dbname=database, user=os.getenv("PG_USER"), password=os.getenv("PG_PASSWORD"),
+                            host=os.getenv("PG_HOST", "localhost"), port=os.getenv("PG_PORT", "5432"))
+
+
+def create_database(database):
+    connection = connect("postgres")
+    connection.autocommit = True
+    with connection.cursor() as cursor:
+        cursor.execute("select 1 from pg_database where datname = %s", (database,))
+        if cursor.fetchone() is None:
+            cursor.execute(f'create database "{database}"')
+            print(f"Created database {database}")
+    connection.close()
+
+
+def read_queries(path):
+    # The queries are taken from solution.sql so the harness measures what the exercise actually runs. Each one
+    # starts at its "-- Query N (...)" comment and ends at the next one or at the end of the file.
+    with open(path) as f:
+        sql = f.read()
+    queries = []
+    sections = re.split(r'^-- Query (\d+) \((.*?)\)?\s*$', sql, flags=re.MULTILINE)
+    for number, title, body in zip(sections[1::3], sections[2::3], sections[3::3]):
+        queries.append({'query': int(number), 'title': title.rstrip('.'), 'sql': body.strip().rstrip(';')})
+    return queries
+
+
+def generate_data(connection, customers, orders, products, seed):
+    start = time.perf_counter()
+    with connection.cursor() as cursor:
+        cursor.execute(CREATE_TABLES)
+        cursor.execute(GENERATE_DATA, {'seed': seed, 'customers': customers, 'orders': orders,
+                                       'products': max(products, 3)})
+    connection.commit()
+    connection.autocommit = True
+    with connection.cursor() as cursor:
+        cursor.execute("vacuum analyze customers, products, orders")
+    connection.autocommit = False
+    print(f"Generated {customers:,} customers, {products:,} products and {orders:,} orders in "
+          f"{time.perf_counter() - start:.1f}s")
+
+
+def plan_scans(plan):
+    # Scan nodes of the plan, "Seq Scan orders" or "Index Only Scan orders_product_id_customer_id_idx".
+    scans = []
+    if 'Scan' in plan['Node Type']:
+        scans.append(f"{plan['Node Type']} {plan.get('Index Name') or plan.get('Relation Name', '')}".strip())
+    for child in plan.get('Plans', []):
+        scans += plan_scans(child)
+    return scans
+
+
+def explain(connection, sql):
+    with connection.cursor() as cursor:
+        cursor.execute(f"explain (analyze, buffers, format json) {sql}")
+        result = cursor.fetchone()[0][0]
+    plan = result['Plan']
+    return {
+        'execution_ms': result['Execution Time'],
+        'planning_ms': result['Planning Time'],
+        'shared_hit_blocks': plan.get('Shared Hit Blocks', 0),
+        'shared_read_blocks': plan.get('Shared Read Blocks', 0),
+        'trigger_ms': sum(trigger['Time'] for trigger in result.get('Triggers', [])),
+        'scans': plan_scans(plan),
+    }
+
+
+def measure_query(connection, sql, runs):
+    # The first run warms the cache and is not counted, the median of the other runs is reported.
+    explain(connection, sql)
+    measurements = [explain(connection, sql) for _ in range(runs)]
+    result = measurements[-1]
+    result['execution_ms'] = statistics.median(m['execution_ms'] for m in measurements)
+    result['trigger_ms'] = statistics.median(m['trigger_ms'] for m in measurements)
+    connection.rollback()
+    return result
+
+
+def measure_foreign_key_check(connection, runs):
+    measurements = []
+    for _ in range(runs + 1):
+        with connection.cursor() as cursor:
+            cursor.execute(FOREIGN_KEY_CHECK)
+            customer_id = cursor.fetchone()[0]
+        measurements.append(explain(connection, f"delete from customers where customer_id = {customer_id}"))
+        connection.rollback()
+    result = measurements[-1]
+    result['execution_ms'] = statistics.median(m['execution_ms'] for m in measurements[1:])
+    result['trigger_ms'] = statistics.median(m['trigger_ms'] for m in measurements[1:])
+    return result
+
+
+def measure_all(connection, queries, runs):
+    results = {f"query_{query['query']}": measure_query(connection, query['sql'], runs) for query in queries}
+    results['delete_customer'] = measure_foreign_key_check(connection, runs)
+    return results
+
+
+def suggest_indexes(connection):
+    with connection.cursor() as cursor:
+        cursor.execute(UNINDEXED_FOREIGN_KEYS)
+        foreign_keys = cursor.fetchall()
+    connection.rollback()
+    suggestions = [(f'{table}_{column}_idx', f'create index {table}_{column}_idx on {table} ({column})')
+                   for table, column in foreign_keys]
+    return suggestions + COVERING_INDEXES
+
+
+def measure_index(connection, name, create_sql, queries, runs):
+    # Every index is measured on its own against the tables without it, then dropped again.
+    start = time.perf_counter()
+    with connection.cursor() as cursor:
+        cursor.execute(create_sql)
+        cursor.execute("analyze orders")
+        cursor.execute("select pg_relation_size(%s)", (name,))
+        size_bytes = cursor.fetchone()[0]
+    connection.commit()
+    build_seconds = time.perf_counter() - start
+    results = measure_all(connection, queries, runs)
+    with connection.cursor() as cursor:
+        cursor.execute(f"drop index {name}")
+    connection.commit()
+    return results, build_seconds, size_bytes
+
+
+def print_comparison(before, after):
+    for name, result in after.items():
+        baseline = before[name]
+        milliseconds = result['execution_ms'] + result['trigger_ms']
+        baseline_milliseconds = baseline['execution_ms'] + baseline['trigger_ms']
+        print(f"  {name:<16} {baseline_milliseconds:>10.1f}ms -> {milliseconds:>10.1f}ms "
+              f"({baseline_milliseconds / max(milliseconds, 0.001):>6.1f}x)  "
+              f"{baseline['shared_hit_blocks'] + baseline['shared_read_blocks']:>8} -> "
+              f"{result['shared_hit_blocks'] + result['shared_read_blocks']:>8} blocks  {', '.join(result['scans'])}")
+
+
+if __name__ == "__main__":
+    load_dotenv()
+    parser = argparse.ArgumentParser(description='Run the shop_db queries of solution.sql on generated data')
+    parser.add_argument('--database', default='shop_db_scale', help='created if missing, its tables are replaced')
+    parser.add_argument('--customers', type=int, default=1_000_000)
+    parser.add_argument('--orders', type=int, default=5_000_000)
+    parser.add_argument('--products', type=int, default=1_000)
+    parser.add_argument('--runs', type=int, default=3, help='measured runs per query, after one warm up run')
+    parser.add_argument('--seed', type=float, default=0.42)
+    parser.add_argument('--skip-generate', action='store_true', help='reuse the tables of an earlier run')
+    parser.add_argument('--output', default=os.path.join(EXERCISE_DIR, 'scale_results.jsonl'))
+    args = parser.parse_args()
+
+    queries = read_queries(os.path.join(EXERCISE_DIR, 'solution.sql'))
+    create_database(args.database)
+    connection = connect(args.database)
+    if not args.skip_generate:
+        generate_data(connection, args.customers, args.orders, args.products, args.seed)
+
+    run_at = datetime.datetime.now(datetime.timezone.utc).isoformat()
+    records = []
+    before = measure_all(connection, queries, args.runs)
+    print("Without indexes")
+    for name, result in before.items():
+        print(f"  {name:<16} {result['execution_ms'] + result['trigger_ms']:>10.1f}ms  "
+              f"{result['shared_hit_blocks'] + result['shared_read_blocks']:>8} blocks  {', '.join(result['scans'])}")
+        records.append({'index': None, 'measured': name, **result})
+
+    for name, create_sql in suggest_indexes(connection):
+        after, build_seconds, size_bytes = measure_index(connection, name, create_sql, queries, args.runs)
+        print(f"{create_sql} (built in {build_seconds:.1f}s, {size_bytes / 1024 ** 2:.1f} MiB)")
+        print_comparison(before, after)
+        for measured, result in after.items():
+            records.append({'index': name, 'create_sql': create_sql, 'build_seconds': round(build_seconds, 3),
+                            'index_bytes': size_bytes, 'measured': measured, **result})
+    connection.close()
+
+    with open(args.output, 'a') as f:
+        for record in records:
+            record.update({'run_at': run_at, 'customers': args.customers, 'orders': args.orders,
+                           'products': args.products})
+            f.write(json.dumps(record) + '\n')
+    print(f'Results appended to {args.output}')